@@ -1,9 +1,171 @@
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from urllib.parse import quote
+
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.files import File
 from storages.backends.s3boto3 import S3Boto3Storage, S3ManifestStaticStorage
 
 
 class MediaRootS3BotoStorage(S3Boto3Storage):
     location = 'media'
 
+    def download_url(self, name, filename, expire=None):
+        """
+        A presigned URL that downloads ``name`` as an attachment called ``filename``. It never uses the custom
+        domain, whose plain URLs cannot set the file name.
+        """
+        fallback = filename.encode('ascii', 'ignore').decode().replace('"', '')
+        params = {
+            'Bucket': self.bucket_name,
+            'Key': self._normalize_name(self._clean_name(name)),
+            'ResponseContentDisposition': 'attachment; filename="{}"; filename*=UTF-8\'\'{}'.format(
+                fallback, quote(filename)),
+        }
+        return self.bucket.meta.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=expire or self.querystring_expire)
+
+
+class LocalCopyFile(File):
+    """
+    An object of CachedMediaRootS3BotoStorage, read from its local copy. Opening it again after it was closed
+    opens the copy of the current version of the object.
+    """
+
+    def __init__(self, storage, name, mode='rb'):
+        self._storage = storage
+        super().__init__(open(storage.path(name), mode), name)
+
+    def open(self, mode=None):
+        if not self.closed:
+            self.seek(0)
+        else:
+            self.file = open(self._storage.path(self.name), mode or self.mode)
+        return self
+
+
+class CachedMediaRootS3BotoStorage(MediaRootS3BotoStorage):
+    """
+    Media storage that keeps a copy of every object it reads on local disk, under MEDIA_CACHE_DIR, so opening the
+    same background or data file again costs a HEAD request instead of a download. Copies are named after the
+    key and the ETag of the object, a rewritten object is downloaded again. The least recently used copies are
+    removed once there are more than MEDIA_CACHE_SIZE bytes of them. Processes on the same host share the copies.
+
+    Files opened for reading are local files, they can be memory-mapped, and ``path`` gives their location.
+    """
+    etag_re = re.compile(r'[^0-9A-Za-z-]')
+
+    def __init__(self, **settings_overrides):
+        super().__init__(**settings_overrides)
+        self.cache_dir = settings.MEDIA_CACHE_DIR
+        self.cache_size = settings.MEDIA_CACHE_SIZE
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _key(self, name):
+        return self._normalize_name(self._clean_name(name))
+
+    def _prefix(self, key):
+        return hashlib.sha256(key.encode()).hexdigest() + '-'
+
+    def _cache_path(self, key, etag):
+        return os.path.join(self.cache_dir, self._prefix(key) + self.etag_re.sub('', etag))
+
+    def _not_found(self, err, key):
+        if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+            return FileNotFoundError('File does not exist: %s' % key)
+        return err
+
+    def _fetch(self, key):
+        """
+        The local copy of ``key``, downloaded first unless a copy of its current version is there already.
+        """
+        try:
+            etag = self.connection.meta.client.head_object(Bucket=self.bucket_name, Key=key)['ETag']
+        except ClientError as err:
+            raise self._not_found(err, key)
+
+        path = self._cache_path(key, etag)
+        try:
+            # The modification time of a copy is when it was last used.
+            os.utime(path)
+            return path
+        except FileNotFoundError:
+            pass
+
+        try:
+            obj = self.bucket.Object(key).get()
+        except ClientError as err:
+            raise self._not_found(err, key)
+        body = obj['Body']
+        if self.gzip and obj.get('ContentEncoding') == 'gzip':
+            body = gzip.GzipFile(mode='rb', fileobj=body)
+
+        # Written under a temporary name and renamed, so no process ever opens half a copy.
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(body, f)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        # The object may have been rewritten since the HEAD request, the copy is named after what was downloaded.
+        path = self._cache_path(key, obj['ETag'])
+        os.replace(tmp, path)
+        self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.cache_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, name):
+        prefix = self._prefix(self._key(name))
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.startswith(prefix):
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    def _open(self, name, mode='rb'):
+        if 'r' not in mode or '+' in mode:
+            return super()._open(name, mode)
+        return LocalCopyFile(self, name, mode)
+
+    def path(self, name):
+        return self._fetch(self._key(name))
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        self.invalidate(name)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        self.invalidate(name)
+
 
 class StaticRootS3BotoStorage(S3ManifestStaticStorage):
     location = 'static'
@@ -1,3 +1,123 @@
-from django.test import TestCase
+import mmap
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase, override_settings
+
+from apps.common.storages import CachedMediaRootS3BotoStorage
+
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+BUCKET = 'media-cache-test'
+
+
+@skipUnless(mock_aws, 'moto is not installed')
+class CachedMediaRootS3BotoStorageTest(SimpleTestCase):
+
+    def setUp(self):
+        env = mock.patch.dict(os.environ, AWS_ACCESS_KEY_ID='testing', AWS_SECRET_ACCESS_KEY='testing',
+                              AWS_DEFAULT_REGION='us-east-1')
+        env.start()
+        self.addCleanup(env.stop)
+
+        aws = mock_aws()
+        aws.start()
+        self.addCleanup(aws.stop)
+        boto3.client('s3').create_bucket(Bucket=BUCKET)
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        overrides = override_settings(AWS_STORAGE_BUCKET_NAME=BUCKET, MEDIA_CACHE_DIR=self.cache_dir,
+                                      MEDIA_CACHE_SIZE=1024 * 1024)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+        self.storage = CachedMediaRootS3BotoStorage()
+        self.downloads = 0
+        self.storage.connection.meta.client.meta.events.register('before-call.s3.GetObject', self._count_download)
+
+    def _count_download(self, **kwargs):
+        self.downloads += 1
+
+    def read(self, name):
+        with self.storage.open(name) as f:
+            return f.read()
+
+    def copies(self):
+        return sorted(os.listdir(self.cache_dir))
+
+    def test_reads_are_served_from_the_local_copy(self):
+        name = self.storage.save('data/a.csv', ContentFile(b'a,b\n1,2\n'))
+
+        self.assertEqual(self.read(name), b'a,b\n1,2\n')
+        self.assertEqual(self.read(name), b'a,b\n1,2\n')
+        self.assertEqual(self.downloads, 1)
+        self.assertEqual(len(self.copies()), 1)
+
+    def test_open_files_are_local_and_can_be_mapped(self):
+        name = self.storage.save('data/a.cols', ContentFile(b'x' * 4096))
+
+        with self.storage.open(name) as f:
+            self.assertEqual(len(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)), 4096)
+        self.assertTrue(os.path.isfile(self.storage.path(name)))
+
+        # Closed files open again from the local copy.
+        f.open()
+        self.assertEqual(f.read(4), b'xxxx')
+        f.close()
+
+    def test_rewritten_objects_are_downloaded_again(self):
+        name = self.storage.save('data/a.csv', ContentFile(b'old'))
+        self.assertEqual(self.read(name), b'old')
+
+        # Written behind the storage's back, only the ETag tells the copy is out of date.
+        boto3.client('s3').put_object(Bucket=BUCKET, Key='media/' + name, Body=b'new')
+
+        self.assertEqual(self.read(name), b'new')
+        self.assertEqual(self.downloads, 2)
+
+    def test_save_drops_the_copies_of_a_name(self):
+        name = self.storage.save('data/a.csv', ContentFile(b'old'))
+        self.read(name)
+        self.assertEqual(len(self.copies()), 1)
+
+        self.storage.save(name, ContentFile(b'new'))
+
+        self.assertEqual(self.copies(), [])
+        self.assertEqual(self.read(name), b'new')
+
+    def test_delete_drops_the_copies_of_a_name(self):
+        name = self.storage.save('data/a.csv', ContentFile(b'data'))
+        self.read(name)
+
+        self.storage.delete(name)
+
+        self.assertEqual(self.copies(), [])
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open(name)
+
+    def test_least_recently_used_copies_are_evicted(self):
+        self.storage.cache_size = 2500
+        names = [self.storage.save('data/%s.csv' % n, ContentFile(n.encode() * 1000)) for n in 'abc']
+        for i, name in enumerate(names[:2]):
+            self.read(name)
+            # Opening a copy marks it used, older times than now keep the order independent of the clock.
+            os.utime(self.storage.path(name), (1000 + i, 1000 + i))
+        self.read(names[0])
+
+        self.read(names[2])
+
+        self.assertEqual(len(self.copies()), 2)
+        downloads = self.downloads
+        self.read(names[0])
+        self.read(names[2])
+        self.assertEqual(self.downloads, downloads)
+        self.read(names[1])
+        self.assertEqual(self.downloads, downloads + 1)
@@ -1,5 +1,19 @@
+import logging
+
 from django.apps import AppConfig
 
+logger = logging.getLogger(__name__)
+
 
 class DocumentConfig(AppConfig):
     name = 'apps.document'
+
+    def ready(self):
+        from apps.document.fonts import register_fonts
+
+        # Load the TTF faces at worker boot so that previews and downloads do no font I/O. Failing here must not
+        # stop the process from starting, renders register whatever is missing on their own.
+        try:
+            register_fonts()
+        except Exception as e:
+            logger.warning('Could not load fonts at startup: %s', e)
@@ -0,0 +1,81 @@
+"""
+Backgrounds parsed for editor previews, kept in process memory so that previewing the same layout again does
+not download and parse its background again.
+
+Uploaded backgrounds are stored under random names and never rewritten, so a storage name always stands for
+the same contents and is all the key needs. The default background is keyed by its path and mtime.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.files.storage import default_storage
+
+from apps.document.models import DEFAULT_BACKGROUND
+from apps.document.renderer import Background
+
+
+class BackgroundCache(object):
+    """
+    A least recently used cache of parsed Backgrounds, holding at most ``max_size`` bytes of PDF files.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, load) -> Background:
+        """
+        The Background cached for ``key``, or a new one parsed from the bytes ``load()`` returns.
+        """
+        with self.lock:
+            background = self.entries.get(key)
+            if background is not None:
+                self.entries.move_to_end(key)
+                return background
+
+        # Loading happens outside the lock, another request may cache the same key meanwhile.
+        background = Background(load())
+        if len(background) > self.max_size:
+            return background
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+            self.entries[key] = background
+            self.size += len(background)
+            while self.size > self.max_size:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+        return background
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+cache = BackgroundCache(settings.PDF_BACKGROUND_CACHE_SIZE)
+
+
+def _read_stored(name):
+    with default_storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def _read_local(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_background(name=None) -> Background:
+    """
+    The parsed background stored as ``name``, or the default one.
+    """
+    if name:
+        return cache.get(('storage', name), lambda: _read_stored(name))
+    path = finders.find(DEFAULT_BACKGROUND)
+    return cache.get(('static', path, os.path.getmtime(path)), lambda: _read_local(path))
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files import File
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from apps.document.models import DEFAULT_BACKGROUND, Document, RenderedOutput
+from apps.document.renderer import RENDERER_VERSION
+from apps.pdf.models import CachedFile
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(f) -> str:
+    """
+    SHA-256 of a stored file. Uploads are saved under fresh random names, so the digest is remembered per name.
+    """
+    def compute():
+        h = hashlib.sha256()
+        with f.open('rb') as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    return cache.get_or_set('file-digest:%s' % f.name, compute, None)
+
+
+def layout_fingerprint(document: Document) -> str:
+    """
+    Everything that decides how a row is drawn, apart from the row itself.
+    """
+    background = file_digest(document.background) if document.background else DEFAULT_BACKGROUND
+    parts = [
+        RENDERER_VERSION,
+        json.dumps(document.layout, sort_keys=True),
+        background,
+        document.headers,
+    ]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def fingerprint(document: Document, limit: int, output='pdf', filename_column='', selection='', query='') -> str:
+    parts = [
+        layout_fingerprint(document),
+        document.data_digest or file_digest(document.file),
+        limit,
+        output,
+        filename_column,
+        str(selection),
+        str(query),
+    ]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def lookup(key: str):
+    """
+    The cached file rendered for ``key``, with its expiry pushed back, or None.
+    """
+    try:
+        entry = RenderedOutput.objects.select_related('file').get(key=key, file__expires__gte=now())
+    except RenderedOutput.DoesNotExist:
+        return None
+    CachedFile.objects.filter(id=entry.file_id).update(expires=expiry())
+    return entry.file
+
+
+def store(document: Document, key: str, filename: str, mimet: str, outfile) -> CachedFile:
+    c = CachedFile()
+    c.expires = expiry()
+    c.date = now()
+    c.filename = filename
+    c.type = mimet
+    c.save()
+    c.file.save(filename, File(outfile))
+
+    # Another request may have rendered the same key meanwhile, the newer file wins.
+    CachedFile.objects.filter(renderedoutput__key=key).delete()
+    RenderedOutput.objects.create(key=key, document=document, file=c, size=c.file.size)
+    evict()
+    return c
+
+
+def invalidate(document: Document):
+    # Files still kept as the document's page archive stay around for the next incremental render.
+    RenderedOutput.objects.filter(document=document, file__pagearchive__isnull=False).delete()
+    # Deleting through the queryset sends post_delete, which removes the stored files as well.
+    CachedFile.objects.filter(renderedoutput__document=document).delete()
+
+
+def evict():
+    """
+    Drop expired files, then the least recently used outputs until the cache fits in PDF_RENDER_CACHE_SIZE.
+    Every hit pushes ``expires`` back by the same amount, so the earliest expiry is the least recently used.
+    """
+    CachedFile.objects.filter(expires__lt=now()).delete()
+
+    excess = (RenderedOutput.objects.aggregate(total=Sum('size'))['total'] or 0) - settings.PDF_RENDER_CACHE_SIZE
+    if excess <= 0:
+        return
+    drop = []
+    for file_id, size in RenderedOutput.objects.order_by('file__expires').values_list('file_id', 'size'):
+        if excess <= 0:
+            break
+        drop.append(file_id)
+        excess -= size
+    logger.debug('Evicting %d rendered outputs', len(drop))
+    CachedFile.objects.filter(id__in=drop).delete()
+
+
+def expiry():
+    return now() + timedelta(hours=settings.PDF_RENDER_CACHE_HOURS)
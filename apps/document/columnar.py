@@ -0,0 +1,248 @@
+"""
+A compact columnar copy of a parsed data file, written once at upload and read back through mmap.
+
+Layout (little endian)::
+
+    header     magic, column count, row count, length of the headers JSON
+    headers    JSON list
+    directory  per column: code width, dictionary size, offsets of the codes, value offsets and value blob
+    columns    per column: one code per row (1, 2 or 4 bytes), then the dictionary of distinct values as
+               offsets into a blob of tagged, encoded values
+
+Every distinct value of a column is stored once, rows only hold its code.
+"""
+import datetime
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+from array import array
+
+MAGIC = b'PMCOLS01'
+HEADER = struct.Struct('<8sIIQ')
+DIRECTORY = struct.Struct('<BIQQQ')
+WIDTHS = ((0xff, 'B'), (0xffff, 'H'), (0xffffffff, 'I'))
+
+_ENCODERS = (
+    # bool before int, datetime before date: they are subclasses.
+    (bool, b'b', lambda v: b'1' if v else b'0'),
+    (int, b'i', lambda v: str(v).encode()),
+    (float, b'f', lambda v: repr(v).encode()),
+    (str, b's', lambda v: v.encode()),
+    (datetime.datetime, b'T', lambda v: v.isoformat().encode()),
+    (datetime.date, b'D', lambda v: v.isoformat().encode()),
+    (datetime.time, b't', lambda v: v.isoformat().encode()),
+)
+
+_DECODERS = {
+    b'N': lambda b: None,
+    b'b': lambda b: b == b'1',
+    b'i': int,
+    b'f': float,
+    b's': lambda b: b.decode(),
+    b'T': lambda b: datetime.datetime.fromisoformat(b.decode()),
+    b'D': lambda b: datetime.date.fromisoformat(b.decode()),
+    b't': lambda b: datetime.time.fromisoformat(b.decode()),
+}
+
+
+def encode_value(value) -> bytes:
+    if value is None:
+        return b'N'
+    for type_, tag, encode in _ENCODERS:
+        if isinstance(value, type_):
+            return tag + encode(value)
+    return b's' + str(value).encode()
+
+
+def decode_value(data: bytes):
+    return _DECODERS[data[:1]](data[1:])
+
+
+def _pad(out, position):
+    padding = -position % 8
+    out.write(b'\0' * padding)
+    return position + padding
+
+
+def write(headers, rows, out) -> int:
+    """
+    Write ``rows`` (lists or dicts keyed by ``headers``) to ``out`` and return the row count.
+    """
+    width = len(headers)
+    dictionaries = [{} for _ in range(width)]
+    codes = [array('I') for _ in range(width)]
+    count = 0
+    for row in rows:
+        if isinstance(row, dict):
+            row = [row.get(h) for h in headers]
+        for c in range(width):
+            value = row[c] if c < len(row) else ''
+            # Keyed by type too, 1, 1.0 and True are equal but do not render the same.
+            code = dictionaries[c].setdefault((type(value), value), len(dictionaries[c]))
+            codes[c].append(code)
+        count += 1
+
+    headers_json = json.dumps(headers, default=str).encode()
+    position = HEADER.size + len(headers_json) + DIRECTORY.size * width
+    out.write(HEADER.pack(MAGIC, width, count, len(headers_json)))
+    out.write(headers_json)
+
+    # The directory needs the offsets, so lay every column out before writing it.
+    blocks = []
+    for c in range(width):
+        values = [encode_value(v) for (_, v) in dictionaries[c]]
+        offsets = array('Q', [0])
+        for v in values:
+            offsets.append(offsets[-1] + len(v))
+        fmt = next(f for limit, f in WIDTHS if len(values) <= limit + 1)
+        blocks.append((fmt, len(values), array(fmt, codes[c]), offsets, b''.join(values)))
+
+    directory = []
+    for fmt, size, column_codes, offsets, blob in blocks:
+        position += -position % 8
+        codes_at = position
+        position += len(column_codes) * column_codes.itemsize
+        position += -position % 8
+        offsets_at = position
+        position += len(offsets) * offsets.itemsize
+        blob_at = position
+        position += len(blob)
+        directory.append(DIRECTORY.pack(column_codes.itemsize, size, codes_at, offsets_at, blob_at))
+    out.write(b''.join(directory))
+
+    position = HEADER.size + len(headers_json) + DIRECTORY.size * width
+    for fmt, size, column_codes, offsets, blob in blocks:
+        position = _pad(out, position)
+        out.write(column_codes.tobytes())
+        position += len(column_codes) * column_codes.itemsize
+        position = _pad(out, position)
+        out.write(offsets.tobytes())
+        position += len(offsets) * offsets.itemsize
+        out.write(blob)
+        position += len(blob)
+    return count
+
+
+class _Column(object):
+
+    def __init__(self, view, width, size, codes_at, offsets_at, blob_at, rows):
+        fmt = {1: 'B', 2: 'H', 4: 'I'}[width]
+        self.size = size
+        self.codes = view[codes_at:codes_at + rows * width].cast(fmt)
+        self.offsets = view[offsets_at:offsets_at + (size + 1) * 8].cast('Q')
+        self.blob = view[blob_at:blob_at + self.offsets[size]]
+        self.values = {}
+
+    def decode(self, code):
+        if code not in self.values:
+            self.values[code] = decode_value(bytes(self.blob[self.offsets[code]:self.offsets[code + 1]]))
+        return self.values[code]
+
+    def value(self, row):
+        return self.decode(self.codes[row])
+
+    def release(self):
+        for view in (self.codes, self.offsets, self.blob):
+            view.release()
+
+
+class ColumnarData(object):
+    """
+    Rows read straight out of a buffer (bytes or an mmap) holding a columnar file. Values are decoded on first
+    use, so reading a few rows costs the same whatever the size of the file.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        magic, width, self.count, headers_length = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a columnar data file')
+        self.headers = json.loads(bytes(self._view[HEADER.size:HEADER.size + headers_length]))
+        directory_at = HEADER.size + headers_length
+        self.columns = [
+            _Column(self._view, *DIRECTORY.unpack_from(buffer, directory_at + c * DIRECTORY.size), self.count)
+            for c in range(width)
+        ]
+
+    def __len__(self):
+        return self.count
+
+    def _select(self, columns=None):
+        if columns is None:
+            return self.headers, self.columns
+        # Like a row dict, a repeated header takes the value of its last column.
+        positions = {header: c for c, header in enumerate(self.headers)}
+        picked = sorted(positions[name] for name in set(columns) if name in positions)
+        return [self.headers[c] for c in picked], [self.columns[c] for c in picked]
+
+    def column(self, header):
+        return self._select([header])[1][0]
+
+    def select(self, columns=None):
+        """
+        The headers of ``columns`` in file order, the order of ``values``.
+        """
+        return self._select(columns)[0]
+
+    def row(self, index: int, columns=None) -> dict:
+        headers, selected = self._select(columns)
+        return dict(zip(headers, (column.value(index) for column in selected)))
+
+    def values(self, limit=None, start=0, columns=None):
+        """
+        Rows ``start`` to ``start + limit`` as tuples, holding only ``columns`` when given.
+        """
+        stop = self.count if limit is None else min(start + limit, self.count)
+        return self.values_at(range(start, stop), columns)
+
+    def values_at(self, indexes, columns=None):
+        """
+        The rows numbered ``indexes`` as tuples, holding only ``columns`` when given.
+        """
+        headers, selected = self._select(columns)
+        for index in indexes:
+            yield tuple([column.value(index) for column in selected])
+
+    def rows(self, limit=None, start=0, columns=None):
+        headers = self.select(columns)
+        for values in self.values(limit, start, columns):
+            yield dict(zip(headers, values))
+
+    def close(self):
+        # Views into an mmap have to go before the mmap can be closed.
+        for column in self.columns:
+            column.release()
+        self._view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def map_file(f):
+    """
+    Memory-map a file object, copying it into a local temporary file first if it has no file descriptor.
+    """
+    try:
+        # A SpooledTemporaryFile still in memory rolls over to disk when asked for its descriptor.
+        fileno = f.fileno()
+        f.flush()
+    except (AttributeError, OSError, ValueError):
+        local = tempfile.TemporaryFile()
+        f.seek(0)
+        shutil.copyfileobj(f, local)
+        local.flush()
+        fileno = local.fileno()
+    return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+
+def open_file(field_file) -> ColumnarData:
+    with field_file.open('rb') as f:
+        return ColumnarData(map_file(f))
@@ -0,0 +1,49 @@
+import logging
+import threading
+
+from django.contrib.staticfiles import finders
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+logger = logging.getLogger(__name__)
+
+# Font name as used by the layout (family plus ' B'/' I' suffixes) -> static file.
+FONTS = {
+    'Arial': 'fonts/Arial.ttf',
+    'Arial I': 'fonts/Arial Italic.ttf',
+    'Arial B': 'fonts/Arial Bold.ttf',
+    'Arial B I': 'fonts/Arial Bold Italic.ttf',
+}
+
+_paths = {}
+_registered = set()
+_lock = threading.Lock()
+
+
+def font_path(name: str) -> str:
+    # Not found is not remembered, the next render looks again.
+    if name not in _paths:
+        path = finders.find(FONTS[name])
+        if not path:
+            raise FileNotFoundError('Font file not found: %s' % FONTS[name])
+        _paths[name] = path
+    return _paths[name]
+
+
+def register_font(name: str):
+    """
+    Load and register a TTF face with reportlab, at most once per process.
+    """
+    if name in _registered:
+        return
+    with _lock:
+        if name in _registered:
+            return
+        pdfmetrics.registerFont(TTFont(name, font_path(name)))
+        _registered.add(name)
+        logger.debug('Registered font %s', name)
+
+
+def register_fonts():
+    for name in FONTS:
+        register_font(name)
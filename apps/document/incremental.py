@@ -0,0 +1,120 @@
+import hashlib
+import json
+import logging
+import tempfile
+
+from django.conf import settings
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+
+from apps.document import cache
+from apps.document.columnar import map_file
+from apps.document.models import Document, PageArchive
+from apps.document.output import PdfDocumentOutput
+from apps.document.parallel import ChunkedPdf, PdfConcatenator
+from apps.document.renderer import layout_columns
+from apps.pdf.models import CachedFile
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 16
+
+
+def row_digest(row: dict, columns) -> bytes:
+    return hashlib.blake2b(json.dumps([row.get(c) for c in columns], default=str).encode(),
+                           digest_size=DIGEST_SIZE).digest()
+
+
+class IncrementalRender(object):
+    """
+    Renders the combined PDF of a document, reusing the pages of the last one (its PageArchive) for rows whose
+    values look the same, and only drawing new or changed rows. Other outputs are rendered as usual.
+    """
+    # With fewer reusable rows than this share, splicing is not worth reading the archive.
+    min_reuse = 0.2
+
+    def __init__(self, document: Document, output):
+        self.document = document
+        self.output = output
+        self.enabled = output.identifier == PdfDocumentOutput.identifier
+        self.key = cache.layout_fingerprint(document) if self.enabled else None
+        self.digests = None
+
+    def _archive(self):
+        try:
+            archive = PageArchive.objects.select_related('file').get(document=self.document, key=self.key)
+        except PageArchive.DoesNotExist:
+            return None
+        if not archive.file.file or archive.file.expires < now():
+            return None
+        return archive
+
+    def stream(self, rows, progress=None):
+        if not self.enabled:
+            return self.output.stream(rows, progress)
+
+        # Only the layout decides the columns, building a Renderer would read the background for nothing.
+        columns = layout_columns(self.output.override_layout, self.output.variables)
+        self.digests = [row_digest(row, columns) for row in rows]
+
+        archive = self._archive()
+        if archive is None:
+            return self.output.stream(rows, progress)
+
+        old_digests = bytes(archive.row_digests)
+        index = {}
+        for i in range(len(old_digests) // DIGEST_SIZE):
+            index.setdefault(old_digests[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE], i)
+        changed = [row for row, d in zip(rows, self.digests) if d not in index]
+        reused = len(rows) - len(changed)
+        if reused < self.min_reuse * len(rows):
+            return self.output.stream(rows, progress)
+
+        logger.debug('Reusing %d of %d pages for document %s', reused, len(rows), self.document.pk)
+        with archive.file.file.open('rb') as f:
+            old = ChunkedPdf(map_file(f))
+
+        new = None
+        if changed:
+            fname, mimet, newfile = self.output.stream(changed, progress and (lambda done: progress(reused + done)))
+            new = ChunkedPdf(map_file(newfile))
+
+        # Walk the rows in order, adding consecutive pages from the same source in one go.
+        outfile = tempfile.SpooledTemporaryFile(max_size=self.output.spool_size)
+        document = PdfConcatenator(outfile, str(_('Document')), settings.APP_NAME)
+        run_source, run_pages = None, []
+        new_page = 0
+        for digest in self.digests:
+            if digest in index:
+                source, page = old, index[digest]
+            else:
+                source, page = new, new_page
+                new_page += 1
+            if source is not run_source and run_pages:
+                document.add_pages(run_source, run_pages)
+                run_pages = []
+            run_source = source
+            run_pages.append(page)
+        if run_pages:
+            document.add_pages(run_source, run_pages)
+        document.close()
+
+        CachedFile.objects.filter(id=archive.file_id).update(expires=cache.expiry())
+        outfile.seek(0)
+        return '%s.pdf' % ("random",), 'application/pdf', outfile
+
+    def remember(self, cached_file: CachedFile):
+        """
+        Keep ``cached_file``, the output just rendered, as the archive for the next render.
+        """
+        if not self.enabled or self.digests is None:
+            return
+        previous = PageArchive.objects.filter(document=self.document).values_list('file_id', flat=True).first()
+        PageArchive.objects.update_or_create(document=self.document, defaults={
+            'key': self.key,
+            'file': cached_file,
+            'row_digests': b''.join(self.digests),
+        })
+        if previous and previous != cached_file.id:
+            # Only drop the old file if the render cache has let go of it too.
+            CachedFile.objects.filter(id=previous, renderedoutput__isnull=True).delete()
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.document.models import Document
+from apps.document.tasks import queue_ingest
+
+
+class Command(BaseCommand):
+    help = 'Write the columnar copy of documents that have none, like those uploaded before it existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue', action='store_true', help='Queue the documents on the django_q cluster.')
+
+    def handle(self, *args, **options):
+        documents = Document.objects.filter(Q(columns='') | Q(columns__isnull=True)).exclude(file='')
+        for document in documents.iterator():
+            if options['queue']:
+                queue_ingest(document)
+                continue
+            try:
+                document.ingest_data()
+            except Exception as e:
+                self.stderr.write('%s: %s' % (document.pk, e))
+                continue
+            self.stdout.write('%s: %d rows' % (document.pk, document.row_count))
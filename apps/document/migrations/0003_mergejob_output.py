@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0002_mergejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergejob',
+            name='filename_column',
+            field=models.CharField(blank=True, max_length=256),
+        ),
+        migrations.AddField(
+            model_name='mergejob',
+            name='output',
+            field=models.CharField(default='pdf', max_length=16),
+        ),
+    ]
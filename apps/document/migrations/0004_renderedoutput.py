@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf', '0001_initial'),
+        ('document', '0003_mergejob_output'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RenderedOutput',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rendered_outputs', to='document.document')),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='pdf.cachedfile')),
+            ],
+        ),
+    ]
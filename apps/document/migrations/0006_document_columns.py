@@ -0,0 +1,30 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:41
+
+import apps.document.models
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0005_pagearchive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='columns',
+            field=models.FileField(blank=True, editable=False, max_length=255, null=True, upload_to=apps.document.models.columns_name),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='data_digest',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='first_row',
+            field=models.JSONField(default=dict, editable=False, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+    ]
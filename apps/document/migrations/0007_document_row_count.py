@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0006_document_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='row_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
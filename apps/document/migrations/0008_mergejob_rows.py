@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0007_document_row_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergejob',
+            name='rows',
+            field=models.CharField(blank=True, max_length=1024),
+        ),
+    ]
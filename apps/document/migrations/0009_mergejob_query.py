@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0008_mergejob_rows'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mergejob',
+            name='query',
+            field=models.CharField(blank=True, max_length=2048),
+        ),
+    ]
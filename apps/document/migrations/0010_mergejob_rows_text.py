@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('document', '0009_mergejob_query'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mergejob',
+            name='rows',
+            field=models.TextField(blank=True),
+        ),
+    ]
@@ -1,15 +1,27 @@
+import hashlib
+import itertools
 import string
+import tempfile
+import uuid
 from collections import OrderedDict
-from io import TextIOWrapper
+from datetime import timedelta
+from io import BytesIO
 
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import FileExtensionValidator
 from django.db import models
 from django.utils.crypto import get_random_string
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
-from tablib import Dataset
 
 from apps.account.models import Account, User
 from apps.common.models import TimestampModel
+from apps.document import columnar, readers
+from apps.document.renderer import layout_columns
+from apps.document.rows import RowSet
+from apps.pdf.models import CachedFile
 
 DEFAULT_BACKGROUND = 'pdf/blank_a4.pdf'
 
@@ -32,15 +44,27 @@ def data_name(instance, filename: str) -> str:
     )
 
 
+def columns_name(instance, filename: str) -> str:
+    secret = get_random_string(length=16, allowed_chars=string.ascii_letters + string.digits)
+    return 'data/{id}/{secret}.cols'.format(
+        id=instance.user_id,
+        secret=secret,
+    )
+
+
 class Document(TimestampModel, models.Model):
     account = models.ForeignKey(Account, on_delete=models.PROTECT)
     name = models.CharField(max_length=256, verbose_name=_('Name'))
 
     headers = models.JSONField(default=list, editable=False)
-    first_row = models.JSONField(default=dict, editable=False)
+    first_row = models.JSONField(default=dict, editable=False, encoder=DjangoJSONEncoder)
 
     file = models.FileField(upload_to=data_name, max_length=255,
                             validators=[FileExtensionValidator(allowed_extensions=['csv', 'xls', 'xlsx'])])
+    # The parsed rows of ``file`` in the format of apps.document.columnar, and the SHA-256 of ``file``.
+    columns = models.FileField(null=True, blank=True, upload_to=columns_name, max_length=255, editable=False)
+    data_digest = models.CharField(max_length=64, blank=True, editable=False)
+    row_count = models.PositiveIntegerField(default=0, editable=False)
 
     layout = models.JSONField(default=list)
     background = models.FileField(null=True, blank=True, upload_to=bg_name, max_length=255)
@@ -56,21 +80,167 @@ class Document(TimestampModel, models.Model):
             for header in self.headers
         )
 
-    def load_data(self):
-        format = self.file.name.split(".")[-1]
-        with self.file.open() as f:
-            if format == 'csv':
-                f = TextIOWrapper(f, "utf-8")
-            return Dataset().load(f, format=format)
+    def get_columns(self, *extra):
+        """
+        The headers the layout draws, and those of ``extra`` that are headers: the only columns a render reads.
+        """
+        return sorted(set(layout_columns(self.layout or [], self.headers)) |
+                      {column for column in extra if column in self.headers})
+
+    @property
+    def file_format(self):
+        return self.file.name.split(".")[-1]
+
+    def iter_rows(self, limit=None, start=0, columns=None):
+        """
+        Yield ``limit`` data rows as dicts, starting at row ``start``, with only ``columns`` in them when given.
+        The columnar copy jumps straight to ``start``; files uploaded before it existed are read up to
+        ``start + limit``.
+        """
+        if self.columns:
+            with columnar.open_file(self.columns) as data:
+                yield from data.rows(limit, start, columns)
+            return
+
+        with self.file.open('rb') as f:
+            headers, rows = readers.read(f, self.file_format, None if limit is None else start + limit, columns)
+            yield from itertools.islice(rows, start, None)
+
+    def load_rows(self, limit=None, start=0, columns=None, query=None) -> RowSet:
+        return self._load_ranges([(start, limit)], columns, query)
+
+    def load_selection(self, selection, columns=None, query=None) -> RowSet:
+        """
+        The rows of a RowSelection, in its order. Only the selected rows are read from the columnar copy.
+        """
+        return self._load_ranges([(start, stop - start) for start, stop in selection.ranges], columns, query)
+
+    def _load_ranges(self, ranges, columns=None, query=None) -> RowSet:
+        # (start, limit) pairs, read into one RowSet without a dict per row from the columnar copy.
+        if self.columns:
+            with columnar.open_file(self.columns) as data:
+                return self._take(data, ranges, columns, query)
+
+        wanted = None if columns is None else set(columns) | (query.columns if query else set())
+        headers = self.headers if wanted is None else [h for h in self.headers if h in wanted]
+        rows = RowSet(headers)
+        rows.extend(self._read_ranges(ranges, headers, wanted))
+        if not query:
+            return rows
+        # Files from before the columnar copy get a temporary one to run the query on.
+        out = BytesIO()
+        columnar.write(headers, rows.values, out)
+        with columnar.ColumnarData(out.getvalue()) as data:
+            return self._take(data, [(0, None)], columns, query)
+
+    def _read_ranges(self, ranges, headers, columns):
+        """
+        The values of ``headers`` in the rows of (start, limit) ``ranges``, in their order, from one pass over the
+        file up to the last row they need. Ranges out of file order keep their rows until the pass is done.
+        """
+        bounds = [(start, None if limit is None else start + limit) for start, limit in ranges]
+        spans = []
+        for start, stop in sorted(bounds, key=lambda b: b[0]):
+            if spans and (spans[-1][1] is None or start < spans[-1][1]):
+                spans[-1] = (spans[-1][0], None if stop is None or spans[-1][1] is None else max(stop, spans[-1][1]))
+            else:
+                spans.append((start, stop))
+        end = None if any(stop is None for _, stop in spans) else max((stop for _, stop in spans), default=0)
+        ordered = spans == bounds
+
+        kept = {}
+        count = 0
+        span = 0
+        for i, row in enumerate(self.iter_rows(end, 0, columns)):
+            count = i + 1
+            while spans[span][1] is not None and spans[span][1] <= i:
+                span += 1
+            if i < spans[span][0]:
+                continue
+            values = [row.get(h) for h in headers]
+            if ordered:
+                yield values
+            else:
+                kept[i] = values
+
+        if not ordered:
+            for start, stop in bounds:
+                for i in range(start, count if stop is None else min(stop, count)):
+                    yield kept[i]
+
+    @staticmethod
+    def _take(data, ranges, columns=None, query=None) -> RowSet:
+        indexes = itertools.chain.from_iterable(
+            range(start, data.count if limit is None else min(start + limit, data.count))
+            for start, limit in ranges
+        )
+        if query:
+            indexes = query.apply(data, indexes)
+        rows = RowSet(data.select(columns))
+        rows.extend(data.values_at(indexes, columns))
+        return rows
+
+    def get_row(self, index: int):
+        rows = self.load_rows(1, index)
+        return rows[0] if rows else None
+
+    def _file_digest(self):
+        h = hashlib.sha256()
+        with self.file.open('rb') as f:
+            for chunk in f.chunks():
+                h.update(chunk)
+        return h.hexdigest()
 
     def populate_data(self):
-        data = self.load_data()
-        if not data.height:
+        """
+        Read the headers and first row of the uploaded file, the rest of it goes into its columnar copy on the
+        django_q cluster, see ``ingest_data``. Returns False when the upload has the same contents as the one
+        already parsed, which is then kept.
+        """
+        digest = self._file_digest()
+        if digest == self.data_digest and self.columns:
+            self.save()
+            return False
+
+        with self.file.open('rb') as f:
+            headers, rows = readers.read(f, self.file_format, 1)
+            first_row = next(rows, None)
+        if first_row is None:
             raise Exception("Empty file")
 
-        self.headers = data.headers
-        self.first_row = data.dict[0]
+        # Until the new copy is written, rows are read from the file itself.
+        if self.columns:
+            self.columns.delete(save=False)
+        self.data_digest = digest
+        self.row_count = 0
+        self.headers = headers
+        self.first_row = first_row
         self.save()
+        return True
+
+    def ingest_data(self) -> bool:
+        """
+        Parse the uploaded file once into its columnar copy. Returns False when there was nothing to do, or the
+        copy was dropped because another file was uploaded meanwhile.
+        """
+        if self.columns:
+            return False
+
+        name = self.file.name
+        out = tempfile.TemporaryFile()
+        with self.file.open('rb') as f:
+            headers, rows = readers.read(f, self.file_format)
+            count = columnar.write(headers, rows, out)
+        out.seek(0)
+        self.columns.save('data.cols', File(out), save=False)
+
+        kept = Document.objects.filter(models.Q(columns='') | models.Q(columns__isnull=True),
+                                       id=self.id, file=name).update(columns=self.columns.name, row_count=count)
+        if not kept:
+            self.columns.delete(save=False)
+            return False
+        self.row_count = count
+        return True
 
     class Meta:
         ordering = ("name",)
@@ -79,6 +249,80 @@ class Document(TimestampModel, models.Model):
         return self.name
 
 
+class MergeJob(TimestampModel, models.Model):
+    """
+    A PDF download rendered on the django_q cluster instead of inside the request.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (QUEUED, _('Queued')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='jobs')
+    user = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, editable=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    output = models.CharField(max_length=16, default='pdf')
+    filename_column = models.CharField(max_length=256, blank=True)
+    # A RowSelection as text, empty for the first ``current_limit`` rows.
+    rows = models.TextField(blank=True)
+    # A RowQuery as text, empty for the rows as they are.
+    query = models.TextField(blank=True)
+    rows_total = models.PositiveIntegerField(default=0)
+    rows_done = models.PositiveIntegerField(default=0)
+    result = models.ForeignKey(CachedFile, null=True, blank=True, on_delete=models.SET_NULL)
+    error = models.TextField(blank=True)
+
+    @property
+    def active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+    @property
+    def stale(self):
+        """
+        Active, but not heard from for longer than a django_q task may run: its worker was killed or died.
+        """
+        return self.active and self.updated_at < now() - timedelta(seconds=settings.Q_CLUSTER['timeout'])
+
+    def fail_if_stale(self) -> bool:
+        if not self.stale:
+            return False
+        self.status = self.FAILED
+        self.error = str(_('Rendering stopped, please download again.'))
+        self.save(update_fields=['status', 'error', 'updated_at'])
+        return True
+
+    class Meta:
+        ordering = ("-created_at",)
+
+
+class RenderedOutput(models.Model):
+    """
+    A finished download kept in storage, found again by the fingerprint of everything that went into it.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='rendered_outputs')
+    file = models.OneToOneField(CachedFile, on_delete=models.CASCADE)
+    size = models.PositiveBigIntegerField(default=0)
+
+
+class PageArchive(models.Model):
+    """
+    The last full PDF rendered for a document with a given layout, with a digest of each row's values in page
+    order, so that pages of unchanged rows can be reused after the data is uploaded again.
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, related_name='page_archive')
+    key = models.CharField(max_length=64)
+    file = models.ForeignKey(CachedFile, on_delete=models.CASCADE)
+    row_digests = models.BinaryField()
+
+
 class Row(object):
 
     qrcode = ""
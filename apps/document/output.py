@@ -1,13 +1,20 @@
+import tempfile
+import zipfile
 from io import BytesIO
 
+from django.conf import settings
 from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
 from django.core.files.storage import default_storage
 from django.http import HttpRequest
 from django.template.loader import get_template
+from django.utils.text import get_valid_filename
 from django.utils.translation import gettext_lazy as _
 
 from apps.document.models import DEFAULT_BACKGROUND
+from apps.document.parallel import ParallelRenderer
 from apps.document.renderer import Renderer
+from apps.document.streaming import StreamingCanvas
 
 
 class PdfDocumentOutput:
@@ -16,6 +23,10 @@ class PdfDocumentOutput:
     download_button_text = _('PDF')
     multi_download_button_text = _('Download PDF')
     long_download_button_text = _('Download PDF')
+    # Streamed output is kept in memory up to this size, then spills to disk.
+    spool_size = 1024 * 1024 * 10
+    # How often ``stream`` reports progress when drawing serially.
+    progress_every = 100
 
     def __init__(self, override_layout=None, override_background=None, variables=None):
         self.override_layout = override_layout
@@ -26,17 +37,21 @@ class PdfDocumentOutput:
     def _register_fonts(self):
         Renderer._register_fonts()
 
-    def _draw_page(self, rows):
-        buffer = BytesIO()
-        objs = self.override_layout
-
+    def _open_background(self):
         if self.override_background:
-            bgf = default_storage.open(self.override_background.name, "rb")
-        else:
-            bgf = self._get_default_background()
+            return default_storage.open(self.override_background.name, "rb")
+        return self._get_default_background()
+
+    def renderer(self):
+        with self._open_background() as background:
+            return Renderer(self.override_layout, background, self.variables)
 
-        p = self._create_canvas(buffer)
-        renderer = Renderer(objs, bgf, self.variables)
+    def _draw_page(self, rows):
+        self._register_fonts()
+        buffer = BytesIO()
+        renderer = self.renderer()
+        p = self._create_canvas(buffer, renderer.geometry.size())
+        renderer.init_canvas(p, _('Document'))
 
         for row in rows:
             renderer.draw_page(p, row, True)
@@ -44,16 +59,41 @@ class PdfDocumentOutput:
         p.save()
         return renderer.render_background(buffer, _('Document'))
 
+    def _parallel(self, rows):
+        return settings.PDF_RENDER_PROCESSES > 1 and len(rows) >= settings.PDF_PARALLEL_MIN_ROWS
+
     def generate(self, rows):
         outbuffer = self._draw_page(rows)
         return '%s.pdf' % ("random",), 'application/pdf', outbuffer.read()
 
-    def _create_canvas(self, buffer):
-        from reportlab.lib import pagesizes
+    def stream(self, rows, progress=None):
+        """
+        Like ``generate``, but pages are written out as they are drawn and a file object is returned instead of
+        bytes, so memory does not grow with the number of rows. ``progress`` is called now and then with the
+        number of rows done so far.
+        """
+        self._register_fonts()
+        renderer = self.renderer()
+        outfile = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+
+        if self._parallel(rows):
+            ParallelRenderer(renderer, settings.PDF_RENDER_PROCESSES).render(rows, outfile, _('Document'), progress)
+        else:
+            p = StreamingCanvas(outfile, pagesize=renderer.geometry.size())
+            renderer.init_canvas(p, _('Document'))
+            for i, row in enumerate(rows, 1):
+                renderer.draw_page(p, row, True)
+                if progress and i % self.progress_every == 0:
+                    progress(i)
+            p.save()
+
+        outfile.seek(0)
+        return '%s.pdf' % ("random",), 'application/pdf', outfile
+
+    def _create_canvas(self, buffer, pagesize):
         from reportlab.pdfgen import canvas
 
-        self._register_fonts()
-        return canvas.Canvas(buffer, pagesize=pagesizes.A4)
+        return canvas.Canvas(buffer, pagesize=pagesize)
 
     def _get_default_background(self):
         return open(finders.find(DEFAULT_BACKGROUND), "rb")
@@ -63,3 +103,65 @@ class PdfDocumentOutput:
         return template.render({
             'request': request
         })
+
+
+class ZipDocumentOutput(PdfDocumentOutput):
+    """
+    One PDF per row, written into a ZIP file. Files are named after ``filename_column``, or numbered when the
+    column is missing or empty.
+    """
+    identifier = 'zip'
+    verbose_name = _('ZIP output')
+    download_button_text = _('ZIP')
+    multi_download_button_text = _('Download ZIP')
+    long_download_button_text = _('Download one PDF per row')
+
+    def __init__(self, override_layout=None, override_background=None, variables=None, filename_column=None):
+        super().__init__(override_layout, override_background, variables)
+        self.filename_column = filename_column
+
+    def _filename(self, row, index, used):
+        name = str(row.get(self.filename_column) or '') if self.filename_column else ''
+        try:
+            name = get_valid_filename(name)[:100]
+        except SuspiciousFileOperation:
+            name = ''
+        name = name or '%05d' % index
+
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = '%s-%d' % (name, n)
+        used.add(candidate)
+        return candidate + '.pdf'
+
+    def _render_each(self, renderer, rows):
+        if self._parallel(rows):
+            return ParallelRenderer(renderer, settings.PDF_RENDER_PROCESSES).render_each(rows, _('Document'))
+        return (renderer.render_row(row, _('Document')) for row in rows)
+
+    def generate(self, rows):
+        fname, mimet, outfile = self.stream(rows)
+        return fname, mimet, outfile.read()
+
+    def stream(self, rows, progress=None):
+        self._register_fonts()
+        renderer = self.renderer()
+        outfile = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        used = set()
+
+        # PDF streams are already compressed, deflating them again costs time for almost nothing.
+        with zipfile.ZipFile(outfile, 'w', zipfile.ZIP_STORED) as zf:
+            for i, (row, data) in enumerate(zip(rows, self._render_each(renderer, rows)), 1):
+                zf.writestr(self._filename(row, i, used), data)
+                if progress and i % self.progress_every == 0:
+                    progress(i)
+
+        outfile.seek(0)
+        return '%s.zip' % ("random",), 'application/zip', outfile
+
+
+def get_output(identifier=None, filename_column=None, **kwargs):
+    if identifier == ZipDocumentOutput.identifier:
+        return ZipDocumentOutput(filename_column=filename_column, **kwargs)
+    return PdfDocumentOutput(**kwargs)
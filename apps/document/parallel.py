@@ -0,0 +1,335 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from reportlab.pdfgen.canvas import Canvas
+
+from apps.document.renderer import Renderer
+
+logger = logging.getLogger(__name__)
+
+REF_RE = re.compile(rb'(\d+) 0 R')
+PARENT_RE = re.compile(rb'/Parent \d+ 0 R')
+# The name of a font subset, prefixed with its six letter tag.
+TAG_RE = re.compile(rb'(/(?:BaseFont|FontName)\s*/)[A-Z]{6}(\+)')
+DESCRIPTOR_RE = re.compile(rb'/FontDescriptor (\d+) 0 R')
+
+
+def text_string(text: str) -> bytes:
+    return b'<feff%s>' % text.encode('utf-16-be').hex().encode()
+
+
+def subset_tag(n: int) -> bytes:
+    tag = b''
+    for _ in range(6):
+        n, letter = divmod(n, 26)
+        tag = bytes([65 + letter]) + tag
+    return tag
+
+
+# One Renderer per pool worker, built by _init_worker.
+_renderer = None
+
+
+def _watch_parent(parent):
+    # A django_q worker killed at its timeout cannot shut its pool down, its processes leave on their own.
+    while os.getppid() == parent:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _init_worker(layout, bg_bytes, variables):
+    threading.Thread(target=_watch_parent, args=(os.getppid(),), daemon=True).start()
+
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+    global _renderer
+    Renderer._register_fonts()
+    _renderer = Renderer(layout, BytesIO(bg_bytes) if bg_bytes else None, variables)
+
+
+def _render_chunk(rows):
+    start = time.perf_counter()
+    buffer = BytesIO()
+    canvas = Canvas(buffer, pagesize=_renderer.geometry.size())
+    for row in rows:
+        _renderer.draw_page(canvas, row, True)
+    canvas.save()
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+def _render_rows(rows, title):
+    start = time.perf_counter()
+    return [_renderer.render_row(row, title) for row in rows], time.perf_counter() - start
+
+
+class ChunkSizer(object):
+    """
+    Picks the number of rows for the next chunk so that each chunk takes about ``target`` seconds to render,
+    based on the rows/second measured on the chunks finished so far.
+    """
+
+    def __init__(self, target=2.0, initial=50, minimum=10, maximum=5000):
+        self.target = target
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.rows = 0
+        self.seconds = 0.0
+
+    def record(self, rows, seconds):
+        self.rows += rows
+        self.seconds += seconds
+        if self.seconds > 0:
+            rate = self.rows / self.seconds
+            self.size = int(min(self.maximum, max(self.minimum, rate * self.target)))
+
+    def next(self):
+        return self.size
+
+
+class ChunkedPdf(object):
+    """
+    The objects of a PDF written by reportlab or by PdfConcatenator, located through its cross-reference table.
+    ``data`` may be an mmap; object bodies are only sliced out when asked for.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        xref = int(data[data.rfind(b'startxref'):].split()[1])
+        tail = data[xref:]
+        lines = tail.split(b'\n', 2)
+        count = int(lines[1].split()[1])
+        # Cross-reference entries are 20 bytes each, the offset is their first 10.
+        first = len(lines[0]) + len(lines[1]) + 2
+        offsets = [int(tail[i:i + 10]) for i in range(first, first + 20 * count, 20)]
+
+        # Objects are written back to back, each one ends where the next one (or the xref table) starts.
+        starts = sorted(offsets[1:]) + [xref]
+        ends = dict(zip(starts, starts[1:]))
+        self.spans = {num: (offsets[num], ends[offsets[num]]) for num in range(1, count)}
+        self._refs = {}
+        self.digests = {}
+
+        catalog = self.object(int(re.search(rb'/Root (\d+) 0 R', tail).group(1)))
+        pages = self.object(int(re.search(rb'/Pages (\d+) 0 R', catalog).group(1)))
+        kids = pages[pages.index(b'/Kids'):]
+        self.pages = [int(n) for n in REF_RE.findall(kids[:kids.index(b']')])]
+
+    def object(self, num) -> bytes:
+        start, end = self.spans[num]
+        body = self.data[start:end]
+        return body[body.index(b'obj\n') + 4:body.rindex(b'endobj')]
+
+    def refs(self, num):
+        """
+        Objects referenced by object ``num``, leaving out the page tree parent.
+        """
+        if num not in self._refs:
+            head = self.object(num).partition(b'\nstream\n')[0]
+            self._refs[num] = [int(n) for n in REF_RE.findall(PARENT_RE.sub(b'', head))]
+        return self._refs[num]
+
+
+class PdfConcatenator(object):
+    """
+    Writes the pages of chunk PDFs, in order, into one document on ``out`` without parsing them into objects.
+
+    Every object reachable from a page is keyed by a digest of its own bytes and of everything it references;
+    objects already written with the same digest (the background form, its images and fonts, font subsets that
+    came out identical) are reused instead of being written again. Only the page list is kept in memory.
+
+    Every chunk tags its font subsets from AAAAAA+ onwards, and so does a background written by reportlab. Tags are
+    left out of the digest and replaced by one per font descriptor, as different subsets in one file must have
+    different tags.
+    """
+
+    def __init__(self, out, title, creator):
+        self.out = out
+        self.title = title
+        self.creator = creator
+        self.offset = 0
+        self.offsets = {}
+        self.written = {}
+        self.kids = []
+        self.counter = 1
+        # Subset tags by the digest of their font descriptor.
+        self.tags = {}
+        # Object 1 is the page tree, written last once every page is known.
+        self.pages_num = self._allocate()
+        self._write(b'%PDF-1.4\n%\223\214\213\236\n')
+
+    def _allocate(self):
+        num = self.counter
+        self.counter += 1
+        return num
+
+    def _write(self, data: bytes):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def _write_object(self, num, body: bytes):
+        self.offsets[num] = self.offset
+        self._write(b'%d 0 obj\n' % num + body + (b'' if body.endswith(b'\n') else b'\n') + b'endobj\n')
+
+    def _digest(self, chunk: ChunkedPdf, num, digests, path):
+        if num in digests:
+            return digests[num]
+        if num in path:
+            # Part of a cycle, keep it unique to this chunk.
+            return None
+        path.add(num)
+        head, sep, stream = chunk.object(num).partition(b'\nstream\n')
+        h = hashlib.sha1(TAG_RE.sub(rb'\1AAAAAA\2', head))
+        h.update(sep)
+        h.update(stream)
+        for ref in chunk.refs(num):
+            child = self._digest(chunk, ref, digests, path)
+            if child is None:
+                h = None
+                break
+            h.update(child)
+        path.discard(num)
+        digests[num] = h.digest() if h else None
+        return digests[num]
+
+    def add(self, data: bytes):
+        return self.add_pages(ChunkedPdf(data))
+
+    def add_pages(self, chunk: ChunkedPdf, pages=None):
+        """
+        Append ``pages`` (indexes into ``chunk.pages``, all of them by default) and whatever they need.
+        """
+        pages = chunk.pages if pages is None else [chunk.pages[i] for i in pages]
+        numbers = {}
+
+        # Pages are always new; every other reachable object is matched by digest first.
+        for page in pages:
+            numbers[page] = self._allocate()
+        todo = [ref for page in pages for ref in chunk.refs(page)]
+        new = []
+        while todo:
+            num = todo.pop()
+            if num in numbers:
+                continue
+            digest = self._digest(chunk, num, chunk.digests, set())
+            if digest is not None and digest in self.written:
+                numbers[num] = self.written[digest]
+                continue
+            numbers[num] = self._allocate()
+            if digest is not None:
+                self.written[digest] = numbers[num]
+            new.append(num)
+            todo.extend(chunk.refs(num))
+
+        def retag(num, head):
+            # A font and its descriptor both name the subset, both are tagged after the descriptor.
+            descriptor = DESCRIPTOR_RE.search(head)
+            key = self._digest(chunk, int(descriptor.group(1)) if descriptor else num, chunk.digests, set())
+            if key is None:
+                key = (id(chunk), num)
+            if key not in self.tags:
+                self.tags[key] = subset_tag(len(self.tags))
+            return TAG_RE.sub(lambda m: m.group(1) + self.tags[key] + m.group(2), head)
+
+        def renumber(num):
+            head, sep, stream = chunk.object(num).partition(b'\nstream\n')
+            if TAG_RE.search(head):
+                head = retag(num, head)
+            head = REF_RE.sub(lambda m: b'%d 0 R' % numbers[int(m.group(1))], PARENT_RE.sub(b'', head))
+            return head + sep + stream
+
+        for num in new:
+            self._write_object(numbers[num], renumber(num))
+        for page in pages:
+            body = renumber(page)
+            head, sep, stream = body.partition(b'\nstream\n')
+            head = head.replace(b'<<', b'<<\n/Parent %d 0 R' % self.pages_num, 1)
+            self._write_object(numbers[page], head + sep + stream)
+            self.kids.append(numbers[page])
+        return len(pages)
+
+    def close(self):
+        self._write_object(self.pages_num, b'<<\n/Type /Pages\n/Count %d\n/Kids [ %s ]\n>>' % (
+            len(self.kids), b' '.join(b'%d 0 R' % k for k in self.kids)))
+        catalog = self._allocate()
+        self._write_object(catalog, b'<<\n/Type /Catalog\n/Pages %d 0 R\n>>' % self.pages_num)
+        info = self._allocate()
+        self._write_object(info, b'<<\n/Title %s\n/Creator %s\n>>' % (
+            text_string(self.title), text_string(self.creator)))
+
+        xref = self.offset
+        entries = [b'0000000000 65535 f '] + [b'%010d 00000 n ' % self.offsets[n] for n in range(1, self.counter)]
+        self._write(b'xref\n0 %d\n' % self.counter + b'\n'.join(entries) + b'\n')
+        self._write(b'trailer\n<<\n/Size %d\n/Root %d 0 R\n/Info %d 0 R\n>>\nstartxref\n%d\n%%%%EOF\n' % (
+            self.counter, catalog, info, xref))
+
+
+class ParallelRenderer(object):
+    """
+    Renders rows in chunks on a pool of processes, each with its own Renderer, and concatenates the chunk PDFs
+    in row order.
+    """
+
+    def __init__(self, renderer: Renderer, processes: int, sizer=None):
+        self.renderer = renderer
+        self.processes = processes
+        self.sizer = sizer or ChunkSizer()
+
+    def _map(self, task, rows):
+        """
+        Run ``task`` on consecutive chunks of ``rows`` in the pool and yield its results in row order.
+        """
+        rows = iter(rows)
+        pending = deque()
+
+        with ProcessPoolExecutor(max_workers=self.processes, initializer=_init_worker,
+                                 initargs=(self.renderer.layout, self.renderer.bg_bytes,
+                                           self.renderer.variables)) as pool:
+            def submit():
+                chunk = list(islice(rows, self.sizer.next()))
+                if chunk:
+                    pending.append((len(chunk), pool.submit(task, chunk)))
+
+            # Keep every worker busy with one chunk queued behind it.
+            for _ in range(self.processes * 2):
+                submit()
+
+            while pending:
+                count, future = pending.popleft()
+                result, seconds = future.result()
+                self.sizer.record(count, seconds)
+                submit()
+                logger.debug('Chunk of %d rows rendered in %.2fs', count, seconds)
+                yield result
+
+    def render(self, rows, out, title, progress=None):
+        """
+        Render ``rows`` into one PDF written to ``out`` and return its page count.
+        """
+        document = PdfConcatenator(out, str(title), settings.APP_NAME)
+        for data in self._map(_render_chunk, rows):
+            document.add(data)
+            if progress:
+                progress(len(document.kids))
+        document.close()
+        return len(document.kids)
+
+    def render_each(self, rows, title):
+        """
+        Render every row into a PDF of its own and yield them in row order.
+        """
+        for files in self._map(partial(_render_rows, title=str(title)), rows):
+            yield from files
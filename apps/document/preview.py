@@ -0,0 +1,79 @@
+"""
+Single page previews of a document's layout. The preview of the saved layout with the first row is rendered
+ahead of time, when the layout is saved, and kept in the render cache.
+"""
+import hashlib
+import json
+from io import BytesIO
+
+from django.core.serializers.json import DjangoJSONEncoder
+from reportlab.pdfgen.canvas import Canvas
+
+from apps.document import cache
+from apps.document.backgrounds import get_background
+from apps.document.models import Document
+from apps.document.renderer import Renderer
+
+
+def render(document: Document, row, layout=None, background_name=None, overlay=False) -> bytes:
+    """
+    A one page PDF of ``row`` drawn with ``layout`` on ``background_name``, or the document's own. With
+    ``overlay`` the page holds the layout only.
+    """
+    Renderer._register_fonts()
+    if background_name is None and document.background:
+        background_name = document.background.name
+    background = get_background(background_name)
+
+    buffer = BytesIO()
+    with background.lock:
+        r = Renderer(
+            document.layout if layout is None else layout,
+            background,
+            document.get_variables(),
+            background_mode='none' if overlay else 'form',
+        )
+        p = Canvas(buffer, pagesize=r.geometry.size())
+        r.init_canvas(p, 'Document')
+        r.draw_page(p, row)
+        p.save()
+        return r.render_background(buffer, 'Document').read()
+
+
+def key(document: Document, overlay=False) -> str:
+    parts = [
+        cache.layout_fingerprint(document),
+        'preview',
+        overlay,
+        json.dumps(document.first_row, sort_keys=True, cls=DjangoJSONEncoder),
+    ]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+def get(document: Document, overlay=False) -> bytes:
+    """
+    The preview of the saved layout with the first row, from the render cache or rendered and stored now.
+    """
+    cached = cache.lookup(key(document, overlay))
+    if cached:
+        with cached.file.open('rb') as f:
+            return f.read()
+    return store(document, overlay)
+
+
+def store(document: Document, overlay=False) -> bytes:
+    data = render(document, document.first_row, overlay=overlay)
+    cache.store(document, key(document, overlay), 'preview.pdf', 'application/pdf', BytesIO(data))
+    return data
+
+
+def precompute(document_id):
+    """
+    Render both previews of a document, queued on the django_q cluster when its layout is saved.
+    """
+    document = Document.objects.filter(id=document_id).first()
+    if document is None or not document.layout:
+        return
+    for overlay in (False, True):
+        if not cache.lookup(key(document, overlay)):
+            store(document, overlay)
@@ -0,0 +1,180 @@
+import math
+import operator
+import re
+from array import array
+from urllib.parse import urlencode
+
+from django.http import QueryDict
+
+FILTER_RE = re.compile(r'^\s*(.+?)\s*(==|!=|<=|>=|=|<|>|~)\s*(.*?)\s*$')
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _text(value) -> str:
+    return '' if value is None else str(value)
+
+
+def _number(value):
+    if isinstance(value, bool) or value is None:
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+
+def sort_key(value):
+    """
+    Numbers, and text that reads as one, in numeric order first, then other text, then empty cells.
+    """
+    number = _number(value)
+    if number is not None:
+        return 0, number, ''
+    text = _text(value)
+    return (1, 0, text) if text else (2, 0, '')
+
+
+class Filter(object):
+
+    def __init__(self, column: str, op: str, value: str):
+        self.column = column
+        self.op = '=' if op == '==' else op
+        self.value = value
+
+    @classmethod
+    def parse(cls, text: str):
+        match = FILTER_RE.match(text)
+        if not match:
+            raise ValueError('Invalid filter: %s' % text)
+        column, op, value = match.groups()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '\'"':
+            value = value[1:-1]
+        return cls(column, op, value)
+
+    def matches(self, value) -> bool:
+        if self.op == '~':
+            return self.value.lower() in _text(value).lower()
+        if self.op not in ('=', '!=') and _text(value) == '':
+            return False
+        # Numbers compare as numbers, so do numeric text cells with an order operator: "9000" < "10000".
+        number = _number(value) if not isinstance(value, str) or self.op not in ('=', '!=') else None
+        limit = _number(self.value)
+        if number is not None and limit is not None:
+            return OPERATORS[self.op](number, limit)
+        return OPERATORS[self.op](_text(value), self.value)
+
+    def __str__(self):
+        return '%s%s%s' % (self.column, self.op, self.value)
+
+
+class RowQuery(object):
+    """
+    Which of the rows of a download to keep, and their order. Applied in that order: ``filters`` (all must
+    match), ``unique`` (the first row of each combination of these columns is kept) and ``sort`` (columns,
+    ``-`` in front for descending; ties keep their order).
+
+    Query parameters: ``where`` (repeatable, ``column=value``, or ``!=``, ``<``, ``<=``, ``>``, ``>=`` and ``~``
+    for contains), ``unique`` and ``sort`` as comma separated columns. For example
+    ``?where=region=North&sort=zip``.
+    """
+    max_filters = 20
+
+    def __init__(self, filters=(), unique=(), sort=()):
+        self.filters = list(filters)
+        self.unique = list(unique)
+        self.sort = list(sort)
+
+    @staticmethod
+    def _columns(text):
+        return [c.strip() for c in (text or '').split(',') if c.strip()]
+
+    @classmethod
+    def from_query(cls, query, headers):
+        """
+        The query in ``query`` (a QueryDict), or None when it has none. Raises ValueError on columns missing
+        from ``headers``.
+        """
+        filters = [Filter.parse(text) for text in query.getlist('where') if text.strip()]
+        if len(filters) > cls.max_filters:
+            raise ValueError('Too many filters')
+        row_query = cls(filters, cls._columns(query.get('unique')), cls._columns(query.get('sort')))
+        if not (row_query.filters or row_query.unique or row_query.sort):
+            return None
+        for column in row_query.columns:
+            if column not in headers:
+                raise ValueError('Unknown column: %s' % column)
+        return row_query
+
+    @classmethod
+    def parse(cls, text: str, headers):
+        return cls.from_query(QueryDict(text), headers)
+
+    @property
+    def columns(self):
+        return {f.column for f in self.filters} | set(self.unique) | {c.lstrip('-') for c in self.sort}
+
+    def apply(self, data, indexes):
+        """
+        The row numbers of ``indexes`` kept by this query, in its order. ``data`` is a ColumnarData: filters
+        and sort keys work on the distinct values of a column, each decoded once, and only row numbers are
+        moved around, never rows.
+        """
+        column = data.column
+
+        indexes = list(indexes)
+        for f in self.filters:
+            c = column(f.column)
+            accepted = bytes(f.matches(c.decode(code)) for code in range(c.size))
+            codes = c.codes
+            indexes = [i for i in indexes if accepted[codes[i]]]
+
+        if self.unique:
+            # Equal values share a code, so codes are enough to find repeats.
+            codes = [column(name).codes for name in self.unique]
+            seen = set()
+            kept = []
+            for i in indexes:
+                key = tuple(c[i] for c in codes)
+                if key not in seen:
+                    seen.add(key)
+                    kept.append(i)
+            indexes = kept
+
+        if self.sort and indexes:
+            # Rank the distinct values of each sort column and fold the ranks of a row into a single integer,
+            # with its position last to keep the sort stable.
+            keys = [0] * len(indexes)
+            for name in self.sort:
+                c = column(name.lstrip('-'))
+                values = [sort_key(c.decode(code)) for code in range(c.size)]
+                rank = array('I', bytes(4 * c.size))
+                r, previous = -1, None
+                for code in sorted(range(c.size), key=values.__getitem__, reverse=name[0] == '-'):
+                    if values[code] != previous:
+                        r, previous = r + 1, values[code]
+                    rank[code] = r
+                codes = c.codes
+                keys = [key * c.size + rank[codes[i]] for key, i in zip(keys, indexes)]
+            count = len(indexes)
+            indexes = [indexes[k % count] for k in sorted(key * count + p for p, key in enumerate(keys))]
+        return indexes
+
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        parts = [('where', str(f)) for f in self.filters]
+        if self.unique:
+            parts.append(('unique', ','.join(self.unique)))
+        if self.sort:
+            parts.append(('sort', ','.join(self.sort)))
+        return urlencode(parts)
@@ -0,0 +1,124 @@
+"""
+Row readers for uploaded data files. Each one yields the header row first, then the data rows as lists,
+reading the file only as far as the rows taken from it. Values come out the same as tablib's import of the
+same format.
+
+Given the ``indexes`` of the columns wanted (a function of the header row), a reader only materializes those
+cells of each data row, in that order.
+"""
+import csv
+from io import TextIOWrapper
+from itertools import islice
+
+import xlrd
+from openpyxl import load_workbook
+from xlrd.xldate import xldate_as_datetime
+
+
+def _pick(row, indexes):
+    return [row[i] if i < len(row) else '' for i in indexes]
+
+
+def csv_rows(f, indexes=None):
+    rows = (row for row in csv.reader(TextIOWrapper(f, "utf-8", newline='')) if row)  # tablib skips blank lines.
+    headers = next(rows, None)
+    if headers is None:
+        return
+    if indexes is None:
+        yield headers
+        yield from rows
+        return
+    picked = indexes(headers)
+    yield headers
+    for row in rows:
+        yield _pick(row, picked)
+
+
+def xlsx_rows(f, indexes=None):
+    book = load_workbook(f, read_only=True, data_only=True)
+    try:
+        sheet = book.active
+        headers = next(sheet.iter_rows(max_row=1, values_only=True), None)
+        if headers is None:
+            return
+        if indexes is None:
+            yield list(headers)
+            for row in sheet.iter_rows(min_row=2, values_only=True):
+                yield list(row)
+            return
+        picked = indexes(headers)
+        yield list(headers)
+        # Cells right of the last column wanted are not turned into values at all.
+        for row in sheet.iter_rows(min_row=2, max_col=max(picked, default=0) + 1, values_only=True):
+            yield _pick(row, picked)
+    finally:
+        book.close()
+
+
+def _xls_cell(value, type_, datemode):
+    if type_ == xlrd.XL_CELL_ERROR:
+        return xlrd.error_text_from_code[value]
+    elif type_ == xlrd.XL_CELL_DATE:
+        return xldate_as_datetime(value, datemode)
+    return value
+
+
+def xls_rows(f, indexes=None):
+    # The old binary format cannot be streamed, but on_demand skips loading the other sheets.
+    book = xlrd.open_workbook(file_contents=f.read(), on_demand=True)
+    try:
+        sheet = book.sheet_by_index(0)
+        if not sheet.nrows:
+            return
+        headers = [_xls_cell(value, type_, book.datemode)
+                   for value, type_ in zip(sheet.row_values(0), sheet.row_types(0))]
+        picked = range(len(headers)) if indexes is None else indexes(headers)
+        yield headers
+        for i in range(1, sheet.nrows):
+            length = sheet.row_len(i)
+            yield [_xls_cell(sheet.cell_value(i, c), sheet.cell_type(i, c), book.datemode) if c < length else ''
+                   for c in picked]
+    finally:
+        book.release_resources()
+
+
+READERS = {
+    'csv': csv_rows,
+    'xlsx': xlsx_rows,
+    'xls': xls_rows,
+}
+
+
+def column_indexes(headers, columns):
+    """
+    Where ``columns`` are in ``headers``, in file order. A repeated header is read from its last column, the
+    value it ends up with in a row dict.
+    """
+    positions = {header: i for i, header in enumerate(headers)}
+    return sorted(positions[c] for c in set(columns) if c in positions)
+
+
+def read(f, format: str, limit=None, columns=None):
+    """
+    Return the headers of ``f`` and an iterator over at most ``limit`` of its rows as dicts. With ``columns``,
+    the dicts only hold those of them found in the headers.
+    """
+    picked = []
+    indexes = None
+    if columns is not None:
+        def pick(headers):
+            picked.extend(column_indexes(headers, columns))
+            return picked
+        indexes = pick
+
+    rows = READERS[format](f, indexes)
+    headers = next(rows, [])
+    keys = headers if columns is None else [headers[i] for i in picked]
+
+    def records():
+        for row in islice(rows, limit):
+            if len(row) < len(keys):
+                row += [''] * (len(keys) - len(row))
+            yield dict(zip(keys, row))
+
+    return headers, records()
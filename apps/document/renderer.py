@@ -1,151 +1,385 @@
 import copy
+import itertools
 import logging
-import uuid
+import re
+import threading
+from functools import lru_cache
 from io import BytesIO
 
 from arabic_reshaper import ArabicReshaper
 from bidi.algorithm import get_display
 from django.conf import settings
-from django.contrib.staticfiles import finders
 from django.utils.html import conditional_escape
 from django.utils.translation import gettext_lazy as _
 from PyPDF2 import PdfFileReader
-from reportlab.graphics import renderPDF
-from reportlab.graphics.barcode.qr import QrCodeWidget
-from reportlab.graphics.shapes import Drawing
-from reportlab.lib.colors import Color
+from reportlab.graphics.barcode import qrencoder
+from reportlab.lib.colors import Color, black
+from reportlab.lib import pagesizes
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.pdfmetrics import getAscentDescent
-from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen.canvas import Canvas
+from reportlab.pdfgen.pathobject import PDFPathObject
 from reportlab.platypus import Paragraph
 
+from apps.document.fonts import register_fonts
+from apps.document.xobject import PageImporter
+
 logger = logging.getLogger(__name__)
 
+# reportlab does not support RTL, ligature-heavy scripts like Arabic. Therefore, we use ArabicReshaper
+# to resolve all ligatures and python-bidi to switch RTL texts. The reshaper is stateless once configured,
+# so one instance is shared by the whole process.
+reshaper = ArabicReshaper(configuration={
+    'delete_harakat': True,
+    'support_ligatures': False,
+})
+
+# Code points that need reshaping or bidi reordering: Hebrew, Arabic, Syriac, Thaana, NKo and the other
+# RTL blocks, their presentation forms, the explicit bidi controls and the supplementary-plane RTL scripts.
+RTL_RE = re.compile(
+    '[\u0590-\u08ff\u200f\u202b\u202e\u2067\ufb1d-\ufdff\ufe70-\ufeff'
+    '\U00010800-\U00010fff\U0001e800-\U0001efff]'
+)
+
+
+def needs_shaping(text: str) -> bool:
+    return not text.isascii() and RTL_RE.search(text) is not None
+
+
+def shape(text: str) -> str:
+    if not needs_shaping(text):
+        return text
+    return "<br/>".join(get_display(reshaper.reshape(line))
+                        for line in text.split("<br/>"))
+
+
+QR_BORDER = 4
+QR_CACHE_SIZE = 256
+
+
+def qr_level(content: str) -> str:
+    level = 'H'
+    if len(content) > 32:
+        level = 'M'
+    if len(content) > 128:
+        level = 'L'
+    return level
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_path(content: str, level: str, size: float) -> PDFPathObject:
+    """
+    Encode ``content`` and return its dark modules as a single path filling a ``size`` square at the origin.
+    Horizontal runs of modules are merged into one rectangle each, the same geometry QrCodeWidget draws as
+    separate shapes.
+    """
+    qr = qrencoder.QRCode(None, getattr(qrencoder.QRErrorCorrectLevel, level))
+    qr.addData(content)
+    qr.make()
+
+    boxsize = size / (qr.getModuleCount() + QR_BORDER * 2.0)
+    path = PDFPathObject()
+    for r, modules in enumerate(qr.modules):
+        c = 0
+        for dark, run in itertools.groupby(map(bool, modules)):
+            count = len(list(run))
+            if dark:
+                path.rect((c + QR_BORDER) * boxsize, size - (r + QR_BORDER + 1) * boxsize,
+                          count * boxsize, boxsize)
+            c += count
+    return path
+
+
+def layout_columns(layout, variables):
+    """
+    The row values ``layout`` draws: the ``content`` of text areas bound to a variable, and ``qrcode`` for
+    barcode areas.
+    """
+    columns = set()
+    for o in layout:
+        if o['type'] == "barcodearea":
+            columns.add("qrcode")
+        elif o['type'] == "textarea" and o['content'] and o['content'] != 'other' and o['content'] in variables:
+            columns.add(o['content'])
+    return sorted(columns)
+
+
+# Part of the render cache key, bump it whenever the same input starts rendering differently.
+RENDERER_VERSION = 3
+
+ALIGN_MAP = {
+    'left': TA_LEFT,
+    'center': TA_CENTER,
+    'right': TA_RIGHT
+}
+
+
+class BarcodeArea(object):
+    """
+    A barcode layout object with its geometry converted to points once per job.
+    """
+    type = 'barcodearea'
+
+    def __init__(self, o: dict):
+        self.size = float(o['size']) * mm
+        self.left = float(o['left']) * mm
+        self.bottom = float(o['bottom']) * mm
+
+
+class TextArea(object):
+    """
+    A text layout object compiled once per job: font, paragraph style and
+    geometry are resolved here so that drawing a row only has to build the
+    paragraph for its own text.
+    """
+    type = 'textarea'
+
+    def __init__(self, o: dict, index: int):
+        self.content = o['content']
+        self.text = o.get('text')
+
+        self.font = o['fontfamily'] or 'Arial'
+        if o['bold']:
+            self.font += ' B'
+        if o['italic']:
+            self.font += ' I'
+
+        fontsize = float(o['fontsize'])
+        self.style = ParagraphStyle(
+            name='textarea-%d' % index,
+            fontName=self.font,
+            fontSize=fontsize,
+            leading=fontsize,
+            autoLeading="max",
+            textColor=Color(o['color'][0] / 255, o['color']
+                            [1] / 255, o['color'][2] / 255),
+            alignment=ALIGN_MAP[o['align']]
+        )
+        self.descent = getAscentDescent(self.font, fontsize)[1]
+        self.width = float(o['width']) * mm
+        self.left = float(o['left']) * mm
+        self.bottom = float(o['bottom']) * mm
+        self.rotation = o.get('rotation', 0) * -1
+        self.downward = o.get('downward', False)
+
+
+class PageGeometry(object):
+    """
+    Page sizes of the background, read from its media boxes once per job, with the rotation and crop box of every
+    page. Without a background every page is ``default`` sized.
+    """
+
+    def __init__(self, pdf=None, default=pagesizes.A4):
+        if pdf:
+            self.sizes, self.rotations, self.crop_boxes = [], [], []
+            for page in pdf.pages:
+                size = (float(page.mediaBox[2]), float(page.mediaBox[3]))
+                crop = tuple(float(x) for x in page.cropBox)
+                self.sizes.append(size)
+                self.rotations.append(int(page['/Rotate']) % 360 if '/Rotate' in page else 0)
+                self.crop_boxes.append(None if crop == (0, 0) + size else crop)
+        else:
+            self.sizes = [tuple(default)]
+            self.rotations = [0]
+            self.crop_boxes = [None]
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def size(self, page=0):
+        return self.sizes[page]
+
+    def apply(self, canvas: Canvas, page=0):
+        """
+        Set up the next page of ``canvas`` like page ``page`` of the background.
+        """
+        width, height = self.sizes[page]
+        rotation = self.rotations[page]
+        # reportlab takes the size of a quarter turned page as it is seen, and swaps it back for the media box.
+        size = (height, width) if rotation in (90, 270) else (width, height)
+        if canvas._pagesize != size:
+            canvas.setPageSize(size)
+        canvas.setPageRotation(rotation)
+        canvas.setCropBox(self.crop_boxes[page])
+
+
+class Background(object):
+    """
+    A background PDF read and parsed once. Renderers built from the same Background share its parsed file,
+    which reads from a single stream: use ``lock`` around renders that may run at the same time.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pdf = PdfFileReader(BytesIO(data), strict=False)
+        self.geometry = PageGeometry(self.pdf)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
 
 class Renderer(object):
+    """
+    Draws one page per row onto a reportlab canvas.
 
-    def __init__(self, layout, background, variables):
+    With ``background_mode='form'`` (the default) the background page is imported once into the output as a
+    form XObject that every page references, so ``render_background`` has nothing left to do. ``'merge'``
+    keeps the older behaviour of merging a copy of the background under every page with PyPDF2. ``'none'``
+    only takes the page sizes from the background and draws the layout on blank pages.
+    """
+    static_form_name = 'static-layout'
+    background_form_name = 'background'
+
+    def __init__(self, layout, background, variables, background_mode='form'):
         self.layout = layout
         self.background = background
         self.variables = variables
+        self.background_mode = background_mode
+        self.plan = self._compile(layout)
+        # Objects that render the same on every row are drawn once into a form XObject that each page references.
+        # Each run of them between objects drawn per row gets a form of its own, so that pages stack the objects
+        # in layout order.
+        self.steps = []
+        for static, objects in itertools.groupby(self.plan, self._is_static):
+            if static:
+                self.steps.append((self.static_form_name + '-%d' % len(self.steps), list(objects)))
+            else:
+                self.steps.extend((None, o) for o in objects)
 
+        # ``background`` is a file object, or a Background that has been parsed already.
         if self.background:
-            self.bg_bytes = self.background.read()
-            self.bg_pdf = PdfFileReader(BytesIO(self.bg_bytes), strict=False)
+            parsed = background if isinstance(background, Background) else Background(background.read())
+            self.bg_bytes = parsed.data
+            self.bg_pdf = parsed.pdf
+            self.geometry = parsed.geometry
         else:
             self.bg_bytes = None
             self.bg_pdf = None
+            self.geometry = PageGeometry()
+
+    @property
+    def columns(self):
+        """
+        The row values that change what a page looks like.
+        """
+        return layout_columns(self.layout, self.variables)
 
     @classmethod
     def _register_fonts(cls):
-        pdfmetrics.registerFont(TTFont('Arial', finders.find('fonts/Arial.ttf')))
-        pdfmetrics.registerFont(TTFont('Arial I', finders.find('fonts/Arial Italic.ttf')))
-        pdfmetrics.registerFont(TTFont('Arial B', finders.find('fonts/Arial Bold.ttf')))
-        pdfmetrics.registerFont(TTFont('Arial B I', finders.find('fonts/Arial Bold Italic.ttf')))
+        register_fonts()
+
+    @classmethod
+    def _compile(cls, layout):
+        plan = []
+        for i, o in enumerate(layout):
+            if o['type'] == "barcodearea":
+                plan.append(BarcodeArea(o))
+            elif o['type'] == "textarea":
+                plan.append(TextArea(o, i))
+        return plan
+
+    def init_canvas(self, canvas: Canvas, title=_('Document')):
+        self.geometry.apply(canvas)
+        canvas.setTitle(str(title))
+        canvas.setCreator(settings.APP_NAME)
+
+    def _is_static(self, o):
+        return o.type == "textarea" and (not o.content or o.content == 'other' or o.content not in self.variables)
+
+    def _draw_static_form(self, canvas: Canvas, name: str, objects, page: int):
+        upperx, uppery = self.geometry.size(page)
+        canvas.beginForm(name, upperx=upperx, uppery=uppery)
+        for o in objects:
+            self._draw_textarea(canvas, o, {})
+        canvas.endForm()
 
-    def _draw_barcodearea(self, canvas: Canvas, o: dict, row: dict):
+    def _draw_barcodearea(self, canvas: Canvas, o: BarcodeArea, row: dict):
         content = row.get("qrcode", "Missing qrcode column")
+        path = qr_path(content, qr_level(content), o.size)
 
-        level = 'H'
-        if len(content) > 32:
-            level = 'M'
-        if len(content) > 128:
-            level = 'L'
-
-        reqs = float(o['size']) * mm
-        qrw = QrCodeWidget(content, barLevel=level,
-                           barHeight=reqs, barWidth=reqs)
-        d = Drawing(reqs, reqs)
-        d.add(qrw)
-        qr_x = float(o['left']) * mm
-        qr_y = float(o['bottom']) * mm
-        renderPDF.draw(d, canvas, qr_x, qr_y)
-
-    def _get_text_content(self, o: dict, row: dict, inner=False):
-        if not o['content']:
+        canvas.saveState()
+        canvas.translate(o.left, o.bottom)
+        canvas.setFillColor(black)
+        canvas.drawPath(path, stroke=0, fill=1)
+        canvas.restoreState()
+
+    def _get_text_content(self, o: TextArea, row: dict, inner=False):
+        if not o.content:
             return '(error)'
 
-        if o['content'] == 'other':
-            return o['text']
+        if o.content == 'other':
+            return o.text
 
-        if o['content'] in self.variables:
-            return row.get(o['content'], '')
+        if o.content in self.variables:
+            return row.get(o.content, '')
 
         return ''
 
-    def _draw_textarea(self, canvas: Canvas, o: dict, row: dict):
-        font = o['fontfamily'] or 'Arial'
-        if o['bold']:
-            font += ' B'
-        if o['italic']:
-            font += ' I'
-
-        align_map = {
-            'left': TA_LEFT,
-            'center': TA_CENTER,
-            'right': TA_RIGHT
-        }
-        style = ParagraphStyle(
-            name=uuid.uuid4().hex,
-            fontName=font,
-            fontSize=float(o['fontsize']),
-            leading=float(o['fontsize']),
-            autoLeading="max",
-            textColor=Color(o['color'][0] / 255, o['color']
-                            [1] / 255, o['color'][2] / 255),
-            alignment=align_map[o['align']]
-        )
+    def _draw_textarea(self, canvas: Canvas, o: TextArea, row: dict):
         text = conditional_escape(
             self._get_text_content(o, row) or "",
         ).replace("\n", "<br/>\n")
 
-        # reportlab does not support RTL, ligature-heavy scripts like Arabic. Therefore, we use ArabicReshaper
-        # to resolve all ligatures and python-bidi to switch RTL texts.
-        configuration = {
-            'delete_harakat': True,
-            'support_ligatures': False,
-        }
-        reshaper = ArabicReshaper(configuration=configuration)
-        text = "<br/>".join(get_display(reshaper.reshape(line))
-                            for line in text.split("<br/>"))
-
-        p = Paragraph(text, style=style)
-        w, h = p.wrapOn(canvas, float(o['width']) * mm, 1000 * mm)
-        ad = getAscentDescent(font, float(o['fontsize']))
+        p = Paragraph(shape(text), style=o.style)
+        w, h = p.wrapOn(canvas, o.width, 1000 * mm)
         canvas.saveState()
         # The ascent/descent offsets here are not really proven to be correct, they're just empirical values to get
         # reportlab render similarly to browser canvas.
-        if o.get('downward', False):
-            canvas.translate(float(o['left']) * mm, float(o['bottom']) * mm)
-            canvas.rotate(o.get('rotation', 0) * -1)
-            p.drawOn(canvas, 0, -h - ad[1] / 2)
+        if o.downward:
+            canvas.translate(o.left, o.bottom)
+            canvas.rotate(o.rotation)
+            p.drawOn(canvas, 0, -h - o.descent / 2)
         else:
-            canvas.translate(float(o['left']) * mm,
-                             float(o['bottom']) * mm + h)
-            canvas.rotate(o.get('rotation', 0) * -1)
-            p.drawOn(canvas, 0, -h - ad[1])
+            canvas.translate(o.left, o.bottom + h)
+            canvas.rotate(o.rotation)
+            p.drawOn(canvas, 0, -h - o.descent)
         canvas.restoreState()
 
-    def draw_page(self, canvas: Canvas, row: dict, show_page=True):
-        for o in self.layout:
-            if o['type'] == "barcodearea":
+    def draw_page(self, canvas: Canvas, row: dict, show_page=True, page=0):
+        self.geometry.apply(canvas, page)
+
+        if self.bg_pdf and self.background_mode == 'form':
+            form_name = '%s-%d' % (self.background_form_name, page)
+            if not canvas.hasForm(form_name):
+                PageImporter(canvas).import_page(self.bg_pdf.getPage(page), form_name)
+            canvas.doForm(form_name)
+
+        for form_name, o in self.steps:
+            if form_name:
+                if not canvas.hasForm(form_name):
+                    self._draw_static_form(canvas, form_name, o, page)
+                canvas.doForm(form_name)
+            elif o.type == "barcodearea":
                 self._draw_barcodearea(canvas, o, row)
-            elif o['type'] == "textarea":
+            elif o.type == "textarea":
                 self._draw_textarea(canvas, o, row)
-
-            if self.bg_pdf:
-                canvas.setPageSize((self.bg_pdf.getPage(0).mediaBox[2],
-                                    self.bg_pdf.getPage(0).mediaBox[3]))
         if show_page:
             canvas.showPage()
 
+    def render_rows(self, rows, title=_('Document')) -> bytes:
+        """
+        Render ``rows`` as a complete PDF of their own, one page each.
+        """
+        buffer = BytesIO()
+        canvas = Canvas(buffer, pagesize=self.geometry.size())
+        self.init_canvas(canvas, title)
+        for row in rows:
+            self.draw_page(canvas, row)
+        canvas.save()
+        return self.render_background(buffer, title).read()
+
+    def render_row(self, row: dict, title=_('Document')) -> bytes:
+        return self.render_rows([row], title)
+
     def render_background(self, buffer, title=_('Document')):
         from PyPDF2 import PdfFileReader, PdfFileWriter
         buffer.seek(0)
+        if self.background_mode != 'merge':
+            return buffer
+
         new_pdf = PdfFileReader(buffer)
         output = PdfFileWriter()
 
@@ -0,0 +1,70 @@
+"""
+Rows of a data file kept as plain tuples next to one shared header-to-index map, instead of a dict per row.
+
+A ``RowSet`` hands out ``Row`` views over its tuples. They read like the row dicts they replace (``row.get``,
+``row[header]``, iteration over headers, equality with dicts), and only live as long as the code using them.
+"""
+from collections.abc import Mapping, Sequence
+
+
+class Row(Mapping):
+    """
+    A read-only view of one row: the values tuple of the row and the header-to-index map of its RowSet.
+    """
+    __slots__ = ('index', 'values')
+
+    def __init__(self, index: dict, values: tuple):
+        self.index = index
+        self.values = values
+
+    def __getitem__(self, key):
+        return self.values[self.index[key]]
+
+    def get(self, key, default=None):
+        i = self.index.get(key)
+        return default if i is None else self.values[i]
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __reduce__(self):
+        # Rows pickled together, a chunk sent to a render process, share one copy of the index.
+        return Row, (self.index, self.values)
+
+    def __repr__(self):
+        return 'Row(%r)' % dict(self)
+
+
+class RowSet(Sequence):
+    """
+    A list of rows with the same ``headers``. A repeated header reads from its last column, as in a row dict.
+    """
+
+    def __init__(self, headers, values=()):
+        self.headers = list(headers)
+        self.index = {header: i for i, header in enumerate(self.headers)}
+        self.values = [tuple(v) for v in values]
+
+    def extend(self, values):
+        self.values.extend(tuple(v) for v in values)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            rows = RowSet.__new__(RowSet)
+            rows.headers, rows.index, rows.values = self.headers, self.index, self.values[i]
+            return rows
+        return Row(self.index, self.values[i])
+
+    def __iter__(self):
+        index = self.index
+        for values in self.values:
+            yield Row(index, values)
+
+    def __len__(self):
+        return len(self.values)
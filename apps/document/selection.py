@@ -0,0 +1,52 @@
+class RowSelection(object):
+    """
+    The rows picked for a download, as ranges of 0-based row indexes (stop excluded) in the order given.
+
+    Query parameters use the 1-based row numbers users see: ``start``/``stop`` (both included), or ``rows``
+    as a list such as ``1,5,10-20``.
+    """
+    max_parts = 1000
+
+    def __init__(self, ranges):
+        self.ranges = [(start, stop) for start, stop in ranges if stop > start]
+
+    @classmethod
+    def parse(cls, text: str):
+        ranges = []
+        for part in text.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            first, _, last = part.partition('-')
+            first, last = int(first), int(last or first)
+            if first < 1 or last < first:
+                raise ValueError('Invalid row range: %s' % part)
+            ranges.append((first - 1, last))
+        if len(ranges) > cls.max_parts:
+            raise ValueError('Too many row ranges')
+        return cls(ranges)
+
+    @classmethod
+    def from_query(cls, query):
+        """
+        The selection in ``query``, or None when it selects nothing in particular. Raises ValueError.
+        """
+        if query.get('rows'):
+            return cls.parse(query['rows'])
+        if query.get('start') or query.get('stop'):
+            start = int(query.get('start') or 1)
+            stop = query.get('stop')
+            return cls.parse('%d-%s' % (start, stop) if stop else '%d-%d' % (start, 2 ** 31))
+        return None
+
+    def clamp(self, limit: int):
+        return RowSelection((start, min(stop, limit)) for start, stop in self.ranges)
+
+    def __len__(self):
+        return sum(stop - start for start, stop in self.ranges)
+
+    def __bool__(self):
+        return True
+
+    def __str__(self):
+        return ','.join('%d-%d' % (start + 1, stop) for start, stop in self.ranges)
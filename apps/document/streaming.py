@@ -0,0 +1,96 @@
+from reportlab.pdfbase import pdfdoc
+from reportlab.pdfgen.canvas import Canvas
+
+
+class StreamingCanvas(Canvas):
+    """
+    A canvas that writes each finished page to ``out`` as soon as ``showPage`` is called and then forgets it,
+    so memory stays flat however many pages are drawn.
+
+    Objects shared by every page (the font dictionary, the page tree, the catalog and the document info) are only
+    complete once drawing is done; they are held back and written by ``save`` together with the cross-reference
+    table. Encryption is not supported.
+    """
+
+    def __init__(self, out, **kwargs):
+        super().__init__(out, **kwargs)
+        self._out = out
+        self._offset = 0
+        self._flushed = 0
+        self._flushed_pages = 0
+        self._write(pdfdoc.pdfdocEnc("%%PDF-%s.%s" % self._doc._pdfVersion) +
+                    b'\n%\223\214\213\236 ReportLab Generated PDF document http://www.reportlab.com\n')
+
+    def _write(self, data: bytes) -> int:
+        offset = self._offset
+        self._out.write(data)
+        self._offset += len(data)
+        return offset
+
+    def _write_object(self, oid):
+        doc = self._doc
+        obj = pdfdoc.PDFIndirectObject(oid, doc.idToObject[oid])
+        doc.idToOffset[oid] = self._write(obj.format(doc))
+        # Keep the id registered so references still resolve, but drop the object itself.
+        doc.idToObject[oid] = None
+
+    def _is_shared(self, oid):
+        doc = self._doc
+        obj = doc.idToObject[oid]
+        return oid == pdfdoc.BasicFonts or any(obj is o for o in (doc.Catalog, doc.Pages, doc.info, doc.Outlines))
+
+    def _flush(self):
+        doc = self._doc
+        # Formatting a page registers its content stream, so the loop also picks up objects added on the way.
+        while self._flushed + 1 in doc.numberToId:
+            self._flushed += 1
+            oid = doc.numberToId[self._flushed]
+            if not self._is_shared(oid):
+                self._write_object(oid)
+
+        pages = doc.Pages.pages
+        for i in range(self._flushed_pages, len(pages)):
+            pages[i] = pdfdoc.PDFObjectReference(pages[i].__InternalName__)
+        self._flushed_pages = len(pages)
+
+    def showPage(self):
+        super().showPage()
+        self._flush()
+
+    def save(self):
+        if len(self._code):
+            self.showPage()
+
+        # The same preparation PDFDocument.GetPDFData does before formatting.
+        doc = self._doc
+        for fnt in doc.delayedFonts:
+            fnt.addObjects(doc)
+        doc.info.invariant = doc.invariant
+        doc.info.digest(doc.signature)
+        doc.Reference(doc.Catalog)
+        doc.Reference(doc.info)
+        doc.Outlines.prepare(doc, self)
+        if doc.Outlines.ready < 0:
+            doc.Catalog.Outlines = None
+        doc.encrypt.prepare(doc)
+
+        ids = []
+        counter = 1
+        while counter in doc.numberToId:
+            oid = doc.numberToId[counter]
+            if oid not in doc.idToOffset:
+                self._write_object(oid)
+            ids.append(oid)
+            counter += 1
+
+        xref = pdfdoc.PDFCrossReferenceTable()
+        xref.addsection(0, ids)
+        xrefoffset = self._write(xref.format(doc))
+        trailer = pdfdoc.PDFTrailer(
+            startxref=xrefoffset,
+            Size=len(ids) + 1,
+            Root=doc.Reference(doc.Catalog),
+            Info=doc.Reference(doc.info),
+            ID=doc.ID(),
+        )
+        self._write(trailer.format(doc))
@@ -0,0 +1,99 @@
+import logging
+from django.db import transaction
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+from django_q.tasks import async_task
+
+from apps.document import cache
+from apps.document.incremental import IncrementalRender
+from apps.document.models import Document, MergeJob
+from apps.document.output import get_output
+from apps.document.query import RowQuery
+from apps.document.selection import RowSelection
+
+logger = logging.getLogger(__name__)
+
+
+def start_job(document: Document, rows_total: int, user=None, output='pdf', filename_column='',
+              selection=None, query=None) -> MergeJob:
+    """
+    Queue a download of ``document``, or return the same one already queued or running for it. A stale one is
+    marked failed and queued again.
+    """
+    rows = str(selection) if selection else ''
+    query = str(query) if query else ''
+    job = document.jobs.filter(status__in=(MergeJob.QUEUED, MergeJob.RUNNING), output=output,
+                               filename_column=filename_column, rows=rows, query=query).first()
+    if job and not job.fail_if_stale():
+        return job
+
+    job = MergeJob.objects.create(document=document, user=user, rows_total=rows_total, output=output,
+                                  filename_column=filename_column, rows=rows, query=query)
+    async_task(render_job, job.id, task_name='merge-%s' % job.id)
+    return job
+
+
+def ingest_data(document_id):
+    document = Document.objects.filter(id=document_id).first()
+    if document is None:
+        return
+    try:
+        document.ingest_data()
+    except Exception:
+        # The document keeps working from its file, only slower.
+        logger.exception('Ingesting the data of document %s failed', document_id)
+
+
+def queue_ingest(document: Document):
+    # Queued once the upload is committed, so that the task sees the new file.
+    transaction.on_commit(lambda: async_task(ingest_data, document.id, task_name='ingest-%d' % document.id))
+
+
+def render_job(job_id):
+    job = MergeJob.objects.select_related('document__account').get(id=job_id)
+    document = job.document
+    # A job given up as stale has been replaced already, django_q may still retry it.
+    if not job.active:
+        return
+    MergeJob.objects.filter(id=job.id).update(status=MergeJob.RUNNING, updated_at=now())
+
+    def progress(done):
+        MergeJob.objects.filter(id=job.id).update(rows_done=done, updated_at=now())
+
+    try:
+        # Keyed on the document as it is rendered now, it may have been edited since the job was queued.
+        limit = document.account.current_limit
+        selection = RowSelection.parse(job.rows).clamp(limit) if job.rows else None
+        query = RowQuery.parse(job.query, document.headers) if job.query else None
+        key = cache.fingerprint(document, limit, job.output, job.filename_column, selection or '', query or '')
+        columns = document.get_columns(job.filename_column)
+        if selection:
+            rows = document.load_selection(selection, columns, query)
+        else:
+            rows = document.load_rows(limit, columns=columns, query=query)
+        if (selection or query) and not rows:
+            raise ValueError(_('No rows selected.'))
+        # Queued before the rows were read, the total is only known now.
+        MergeJob.objects.filter(id=job.id).update(rows_total=len(rows), updated_at=now())
+        render = IncrementalRender(document, get_output(
+            job.output,
+            filename_column=job.filename_column,
+            override_layout=document.layout,
+            override_background=document.background,
+            variables=document.get_variables(),
+        ))
+        fname, mimet, outfile = render.stream(rows, progress)
+        c = cache.store(document, key, '%s.%s' % (document.name, fname.split('.')[-1]), mimet, outfile)
+        if not (selection or query):
+            render.remember(c)
+    except Exception as e:
+        logger.exception('Merge job %s failed', job.id)
+        job.status = MergeJob.FAILED
+        job.error = str(e)
+        job.save(update_fields=['status', 'error', 'updated_at'])
+        return
+
+    job.status = MergeJob.DONE
+    job.rows_done = len(rows)
+    job.result = c
+    job.save(update_fields=['status', 'rows_done', 'result', 'updated_at'])
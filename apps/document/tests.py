@@ -1,3 +1,138 @@
-from django.test import TestCase
+import sys
+from io import BytesIO
+from unittest import skipUnless
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+from PyPDF2 import PdfFileReader
+from reportlab.pdfgen.canvas import Canvas
+
+from apps.document.output import PdfDocumentOutput
+from apps.document.parallel import PdfConcatenator
+from apps.document.renderer import Renderer
+from apps.document.streaming import StreamingCanvas
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+LAYOUT = [
+    {'type': 'textarea', 'content': 'name', 'fontfamily': 'Arial', 'bold': True, 'italic': False, 'fontsize': '12',
+     'color': [0, 0, 0], 'align': 'left', 'width': '80', 'left': '20', 'bottom': '250'},
+    {'type': 'textarea', 'content': 'city', 'fontfamily': 'Arial', 'bold': False, 'italic': False, 'fontsize': '10',
+     'color': [0, 0, 0], 'align': 'left', 'width': '80', 'left': '20', 'bottom': '240'},
+    {'type': 'textarea', 'content': 'other', 'text': 'Hello', 'fontfamily': 'Arial', 'bold': False, 'italic': True,
+     'fontsize': '10', 'color': [0, 0, 0], 'align': 'left', 'width': '80', 'left': '20', 'bottom': '200'},
+    {'type': 'barcodearea', 'size': '30', 'left': '150', 'bottom': '20'},
+]
+VARIABLES = {'name': {}, 'city': {}, 'qrcode': {}}
+
+
+def make_rows(count):
+    return [{'name': 'Name %d' % i, 'city': 'City %d' % (i % 7), 'qrcode': 'https://example.com/%d' % (i % 5)}
+            for i in range(count)]
+
+
+class StreamingCanvasTest(SimpleTestCase):
+
+    def render(self, rows):
+        Renderer._register_fonts()
+        renderer = Renderer(LAYOUT, None, VARIABLES)
+        out = BytesIO()
+        canvas = StreamingCanvas(out, pagesize=renderer.geometry.size())
+        renderer.init_canvas(canvas, 'Streamed')
+        for row in rows:
+            renderer.draw_page(canvas, row)
+        canvas.save()
+        out.seek(0)
+        return out
+
+    def test_output_parses_with_one_page_per_row(self):
+        pdf = PdfFileReader(self.render(make_rows(25)), strict=True)
+
+        self.assertEqual(pdf.getNumPages(), 25)
+        self.assertEqual(pdf.getDocumentInfo().title, 'Streamed')
+        for page in pdf.pages:
+            self.assertEqual([round(float(x), 2) for x in page.mediaBox], [0, 0, 595.28, 841.89])
+            self.assertTrue(page.getContents().getData())
+
+    def test_empty_document_parses(self):
+        pdf = PdfFileReader(self.render([]), strict=True)
+
+        # Without pages drawn, like a plain Canvas.
+        self.assertEqual(pdf.getNumPages(), 0)
+
+
+class StaticFormTest(SimpleTestCase):
+
+    def test_static_areas_keep_their_place_in_the_layout(self):
+        Renderer._register_fonts()
+        # The barcode is drawn per row between two static text areas, the city after the second one.
+        layout = [LAYOUT[2], LAYOUT[3], dict(LAYOUT[2], text='Over'), LAYOUT[1]]
+        renderer = Renderer(layout, None, VARIABLES)
+
+        steps = [[o.text for o in objects] if form else objects.type for form, objects in renderer.steps]
+        self.assertEqual(steps, [['Hello'], 'barcodearea', ['Over'], 'textarea'])
+
+
+class PdfConcatenatorTest(SimpleTestCase):
+
+    def chunk(self, renderer, rows):
+        out = BytesIO()
+        canvas = Canvas(out, pagesize=renderer.geometry.size())
+        for row in rows:
+            renderer.draw_page(canvas, row, True)
+        canvas.save()
+        return out.getvalue()
+
+    def test_font_subsets_have_tags_of_their_own(self):
+        Renderer._register_fonts()
+        renderer = Renderer(LAYOUT, None, VARIABLES)
+        out = BytesIO()
+        document = PdfConcatenator(out, 'Concatenated', 'Test')
+        # Characters outside ASCII make each chunk's subsets differ, the same rows make them equal.
+        for letter in 'ĀāĀ':
+            document.add(self.chunk(renderer, [{'name': letter * 3, 'city': letter, 'qrcode': ''}] * 2))
+        document.close()
+
+        subsets = {}
+        for page in PdfFileReader(out, strict=True).pages:
+            for font in page['/Resources']['/Font'].values():
+                font = font.getObject()
+                if '/FontDescriptor' in font:
+                    descriptor = font['/FontDescriptor'].getObject()
+                    self.assertEqual(font['/BaseFont'], descriptor['/FontName'])
+                    subsets.setdefault(font['/BaseFont'], set()).add(descriptor['/FontFile2'].getData())
+        # One name per subset: two each of the bold and regular font, the italic one drew the same text twice.
+        self.assertEqual({len(files) for files in subsets.values()}, {1})
+        self.assertEqual(sorted(name.split('+')[1] for name in subsets),
+                         ['Arial-BoldMT', 'Arial-BoldMT', 'Arial-ItalicMT', 'ArialMT', 'ArialMT'])
+
+
+@skipUnless(resource, 'peak RSS is not available on this platform')
+@override_settings(PDF_RENDER_PROCESSES=1)
+class StreamMemoryTest(SimpleTestCase):
+    rows = 200
+    # Rendering 10 times the rows in memory grows the peak RSS by about 34 MB, streamed by about 2 MB.
+    max_growth = 10 * 1024 * 1024
+
+    def stream(self, count):
+        rows = make_rows(count)
+        output = PdfDocumentOutput(LAYOUT, None, VARIABLES)
+        # Spill to disk early, so that the size of the output does not count.
+        output.spool_size = 64 * 1024
+        fname, mimet, outfile = output.stream(rows)
+        return outfile
+
+    def peak_rss(self):
+        # ru_maxrss is in kilobytes, on macOS in bytes.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+    def test_peak_memory_does_not_grow_with_rows(self):
+        self.stream(self.rows).close()
+        peak = self.peak_rss()
+
+        with self.stream(self.rows * 10) as outfile:
+            growth = self.peak_rss() - peak
+            self.assertEqual(PdfFileReader(outfile).getNumPages(), self.rows * 10)
+        self.assertLess(growth, self.max_growth)
@@ -7,6 +7,10 @@ app_name = 'document'
 urlpatterns = [
     path('<int:pk>/delete', views.DeleteView.as_view(), name='delete'),
     path('<int:pk>/download', views.DownloadView.as_view(), name='download'),
+    path('<int:pk>/jobs/<uuid:job>', views.JobView.as_view(), name='job'),
+    path('<int:pk>/jobs/<uuid:job>/status', views.JobStatusView.as_view(), name='job_status'),
+    path('<int:pk>/jobs/<uuid:job>/download', views.JobDownloadView.as_view(), name='job_download'),
+    path('<int:pk>/preview', views.PreviewView.as_view(), name='preview'),
     path('<int:pk>/editor', views.EditorView.as_view(), name='editor'),
     path('<int:pk>', views.DetailView.as_view(), name='detail'),
     path('new', views.CreateView.as_view(), name='new'),
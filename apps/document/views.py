@@ -1,39 +1,57 @@
 import json
 import logging
-from io import BytesIO
 
 from django import forms
 from django.contrib import messages
 from django.contrib.auth.mixins import (LoginRequiredMixin,
                                         PermissionRequiredMixin)
-from django.contrib.staticfiles import finders
-from django.core.files import File
-from django.core.files.storage import default_storage
+from django.conf import settings
 from django.db import transaction
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render, reverse
 from django.templatetags.static import static
 from django.utils.functional import cached_property
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django.views import generic
-from reportlab.lib import pagesizes
-from reportlab.pdfgen import canvas
+from django_q.tasks import async_task
 
 from apps.common.views import PAGINATE_BY, AccountView
-from apps.document.models import DEFAULT_BACKGROUND, Document
-from apps.document.output import PdfDocumentOutput
-from apps.document.renderer import Renderer
+from apps.document import cache, preview
+from apps.document.incremental import IncrementalRender
+from apps.document.models import DEFAULT_BACKGROUND, Document, MergeJob
+from apps.document.output import get_output
+from apps.document.query import RowQuery
+from apps.document.selection import RowSelection
+from apps.document.tasks import queue_ingest, start_job
 from apps.pdf.models import CachedFile
 from apps.pdf.views import BaseEditorView
 
 logger = logging.getLogger(__name__)
 
 
+def attachment(f, filename):
+    resp = FileResponse(f, content_type='application/octet-stream')
+    resp['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+    return resp
+
+
+def download(c: CachedFile, filename):
+    """
+    Send ``c`` as ``filename``. Storages that can give out a URL for it, like S3, are left to send it themselves
+    so that no web worker is kept busy meanwhile.
+    """
+    storage = c.file.storage
+    if settings.PDF_DOWNLOAD_REDIRECT and hasattr(storage, 'download_url'):
+        return redirect(storage.download_url(c.file.name, filename))
+    return attachment(c.file.open('rb'), filename)
+
+
 class DownloadView(LoginRequiredMixin, BaseEditorView):
     title = _('PDF download')
 
     def get_output(self, *args, **kwargs):
-        return PdfDocumentOutput(*args, **kwargs)
+        return get_output(self.request.GET.get('output'), self.request.GET.get('column'), *args, **kwargs)
 
     def get_layout_settings_key(self):
         return 'pdf_layout'
@@ -60,20 +78,121 @@ class DownloadView(LoginRequiredMixin, BaseEditorView):
     def get(self, request, *args, **kwargs):
         document = get_object_or_404(Document, pk=kwargs.get('pk'),
                                      account=request.user.account)
-        return self.pdf_by_document(document)
-
-    def pdf_by_document(self, document: Document):
+        output = request.GET.get('output') or 'pdf'
+        column = request.GET.get('column') or ''
         limit = document.account.current_limit
 
-        fname, mimet, data = self.generate(
-            document.load_data().dict[:limit],
-            document.layout,
-            document.background,
-            document.get_variables(),
-        )
-        ftype = fname.split(".")[-1]
-        resp = HttpResponse(data, content_type='application/octet-stream')
-        resp['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(document.name, ftype)
+        # Selected rows are still bounded by the plan limit.
+        try:
+            selection = RowSelection.from_query(request.GET)
+            query = RowQuery.from_query(request.GET, document.headers)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        if selection:
+            selection = selection.clamp(min(limit, document.row_count) if document.row_count else limit)
+            if not len(selection):
+                return HttpResponseBadRequest(_('No rows selected.'))
+
+        key = cache.fingerprint(document, limit, output, column, selection or '', query or '')
+        cached = cache.lookup(key)
+        if cached:
+            return download(cached, '{}.{}'.format(document.name, cached.filename.split(".")[-1]))
+
+        # Decided without reading the rows, which for a file without its columnar copy yet means parsing all of
+        # it. Until the copy is written the count is unknown, and a query may match fewer rows than counted.
+        if selection:
+            count = len(selection)
+        else:
+            count = min(limit, document.row_count) if document.row_count else None
+        if count is None or count >= settings.PDF_ASYNC_MIN_ROWS:
+            job = start_job(document, count or 0, request.user, output, column, selection, query)
+            return redirect(reverse("document:job", kwargs={'pk': document.id, 'job': job.id}))
+
+        columns = document.get_columns(column)
+        if selection:
+            rows = document.load_selection(selection, columns, query)
+        else:
+            rows = document.load_rows(limit, columns=columns, query=query)
+        if (selection or query) and not rows:
+            return HttpResponseBadRequest(_('No rows selected.'))
+        return self.pdf_by_document(document, rows, key, partial=bool(selection or query))
+
+    def pdf_by_document(self, document: Document, rows=None, key=None, partial=False):
+        if rows is None:
+            columns = document.get_columns(self.request.GET.get('column') or '')
+            rows = document.load_rows(document.account.current_limit, columns=columns)
+
+        render = IncrementalRender(document, self.get_output(
+            override_layout=document.layout,
+            override_background=document.background,
+            variables=document.get_variables(),
+        ))
+        fname, mimet, outfile = render.stream(rows)
+        filename = '{}.{}'.format(document.name, fname.split(".")[-1])
+        if key:
+            c = cache.store(document, key, filename, mimet, outfile)
+            # A selection reuses the archived pages, but only a full render replaces them.
+            if not partial:
+                render.remember(c)
+            # Uploading may close the file, what is sent is the stored copy.
+            outfile.close()
+            return download(c, filename)
+        return attachment(outfile, filename)
+
+
+class JobMixin(LoginRequiredMixin):
+
+    def get_job(self):
+        return get_object_or_404(MergeJob.objects.select_related('document', 'result'), id=self.kwargs['job'],
+                                 document_id=self.kwargs['pk'], document__account=self.request.user.account)
+
+
+class JobView(JobMixin, generic.TemplateView):
+    template_name = 'document/job.html'
+
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['job'] = self.get_job()
+        return ctx
+
+
+class JobStatusView(JobMixin, generic.View):
+
+    def get(self, request, *args, **kwargs):
+        job = self.get_job()
+        job.fail_if_stale()
+        return JsonResponse({
+            'status': job.status,
+            'rows_done': job.rows_done,
+            'rows_total': job.rows_total,
+            'error': job.error,
+            'url': reverse('document:job_download', kwargs={'pk': job.document_id, 'job': job.id})
+            if job.status == MergeJob.DONE else None,
+        })
+
+
+class JobDownloadView(JobMixin, generic.View):
+
+    def get(self, request, *args, **kwargs):
+        job = self.get_job()
+        if job.status != MergeJob.DONE or not job.result or job.result.expires < now():
+            raise Http404()
+
+        return download(job.result, job.result.filename)
+
+
+class PreviewView(LoginRequiredMixin, generic.View):
+    """
+    The first row drawn with the saved layout, usually rendered when the layout was saved.
+    """
+
+    def get(self, request, *args, **kwargs):
+        document = get_object_or_404(Document, pk=kwargs.get('pk'), account=request.user.account)
+        if not document.layout:
+            raise Http404()
+
+        resp = HttpResponse(preview.get(document), content_type='application/pdf')
+        resp['Content-Disposition'] = 'inline; filename="{}-preview.pdf"'.format(document.name)
         return resp
 
 
@@ -94,35 +213,41 @@ class EditorView(LoginRequiredMixin, BaseEditorView):
     def save_layout(self):
         self.document.layout = json.loads(self.request.POST.get("data"))
         self.document.save(update_fields=['layout'])
+        cache.invalidate(self.document)
+        async_task(preview.precompute, self.document.id, task_name='preview-%d' % self.document.id)
 
     def get_preview_data(self):
+        try:
+            index = int(self.request.POST.get('row', 1)) - 1
+        except ValueError:
+            index = 0
+        if 0 < index < self.document.row_count:
+            row = self.document.get_row(index)
+            if row is not None:
+                return row
         return self.document.first_row
 
+    def get_context_data(self, **kwargs):
+        ctx = super().get_context_data(**kwargs)
+        ctx['row_count'] = self.document.row_count
+        return ctx
+
     def get_default_background(self):
         return static(DEFAULT_BACKGROUND)
 
-    def generate(self, row, override_layout=None, override_background=None):
-        Renderer._register_fonts()
-
-        buffer = BytesIO()
-        if override_background:
-            bgf = default_storage.open(override_background.name, "rb")
-        elif isinstance(self.document.background, File) and self.document.background.name:
-            bgf = default_storage.open(self.document.background.name, "rb")
-        else:
-            bgf = open(finders.find(DEFAULT_BACKGROUND), "rb")
-
-        r = Renderer(
-            override_layout or self.get_current_layout(),
-            bgf,
-            self.get_variables(),
+    def generate(self, row, override_layout=None, override_background=None, overlay=False):
+        # The saved layout with the first row is usually rendered already, since the layout was saved.
+        if row is self.document.first_row and not override_background and \
+                override_layout in (None, self.document.layout):
+            return 'out.pdf', 'application/pdf', preview.get(self.document, overlay)
+
+        data = preview.render(
+            self.document, row,
+            layout=override_layout or self.get_current_layout(),
+            background_name=override_background.name if override_background else None,
+            overlay=overlay,
         )
-
-        p = canvas.Canvas(buffer, pagesize=pagesizes.A4)
-        r.draw_page(p, row)
-        p.save()
-        outbuffer = r.render_background(buffer, 'Document')
-        return 'out.pdf', 'application/pdf', outbuffer.read()
+        return 'out.pdf', 'application/pdf', data
 
     def get_current_layout(self):
         return self.document.layout
@@ -135,6 +260,7 @@ class EditorView(LoginRequiredMixin, BaseEditorView):
         if self.document.background:
             self.document.background.delete()
         self.document.background.save('background.pdf', f.file)
+        cache.invalidate(self.document)
 
 
 class IndexView(PermissionRequiredMixin, AccountView, generic.ListView):
@@ -178,6 +304,7 @@ class CreateView(PermissionRequiredMixin, generic.CreateView):
 
             try:
                 instance.populate_data()
+                queue_ingest(instance)
                 messages.add_message(self.request, messages.INFO, 'Create document success!')
             except Exception as e:
                 messages.add_message(self.request, messages.ERROR, str(e))
@@ -212,9 +339,15 @@ class DetailView(PermissionRequiredMixin, AccountView, generic.DetailView):
             instance.save()
 
             try:
-                instance.populate_data()
+                # Uploading the same data again keeps what was rendered from it.
+                if instance.populate_data():
+                    queue_ingest(instance)
+                    cache.invalidate(instance)
+                    if instance.layout:
+                        async_task(preview.precompute, instance.id, task_name='preview-%d' % instance.id)
                 messages.add_message(self.request, messages.INFO, 'Create document success!')
             except Exception as e:
+                cache.invalidate(instance)
                 messages.add_message(self.request, messages.ERROR, str(e))
             return redirect(reverse("document:detail", kwargs={'pk': instance.id}))
 
@@ -234,6 +367,8 @@ class DeleteView(PermissionRequiredMixin, AccountView, generic.DetailView):
     def post(self, *args, **kwargs):
         document = self.get_object()
         document.file.delete()
+        if document.columns:
+            document.columns.delete(save=False)
         document.delete()
 
         messages.add_message(self.request, messages.INFO, 'Delete document success.')
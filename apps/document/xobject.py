@@ -0,0 +1,84 @@
+import zlib
+from io import BytesIO
+
+from PyPDF2.generic import (ArrayObject, DictionaryObject, IndirectObject,
+                            StreamObject)
+from reportlab.pdfbase.pdfdoc import (PDFArray, PDFDictionary, PDFName,
+                                      PDFStream, xObjectName)
+from reportlab.pdfgen.canvas import Canvas
+
+
+class PageImporter(object):
+    """
+    Copies PyPDF2 objects into a reportlab document. Indirect objects are
+    registered once per document, so resources shared between pages (fonts,
+    images) are written to the output a single time.
+    """
+
+    def __init__(self, canvas: Canvas):
+        self.doc = canvas._doc
+        self.refs = {}
+
+    def convert(self, obj):
+        if isinstance(obj, IndirectObject):
+            return self._indirect(obj)
+        if isinstance(obj, DictionaryObject):
+            return PDFDictionary({k[1:]: self.convert(v) for k, v in obj.items()})
+        if isinstance(obj, ArrayObject):
+            return PDFArray([self.convert(v) for v in obj])
+        # Scalars are passed through to reportlab already serialized.
+        out = BytesIO()
+        obj.writeToStream(out, None)
+        return out.getvalue()
+
+    def _indirect(self, obj: IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in self.refs:
+            return self.refs[key]
+
+        target = obj.getObject()
+        if isinstance(target, StreamObject):
+            rlobj = PDFStream(PDFDictionary(), target._data)
+            items = rlobj.dictionary.dict
+        elif isinstance(target, DictionaryObject):
+            rlobj = PDFDictionary()
+            items = rlobj.dict
+        elif isinstance(target, ArrayObject):
+            rlobj = PDFArray([])
+            self.refs[key] = self.doc.Reference(rlobj)
+            rlobj.sequence.extend(self.convert(v) for v in target)
+            return self.refs[key]
+        else:
+            return self.convert(target)
+
+        # Register before recursing so that cycles resolve to the same reference.
+        self.refs[key] = self.doc.Reference(rlobj)
+        for k, v in target.items():
+            # reportlab computes the stream length itself.
+            if k != '/Length' or not isinstance(target, StreamObject):
+                items[k[1:]] = self.convert(v)
+        return self.refs[key]
+
+    def import_page(self, page, name: str):
+        """
+        Register ``page`` as a form XObject called ``name``, ready for ``canvas.doForm(name)``.
+        """
+        contents = page.getContents()
+        if contents is None:
+            data = b''
+        elif isinstance(contents, ArrayObject):
+            # Content split over several streams is one program: join them with a separator.
+            data = b'\n'.join(stream.getObject().getData() for stream in contents)
+        else:
+            data = contents.getData()
+
+        form = PDFStream(PDFDictionary(), zlib.compress(data))
+        d = form.dictionary.dict
+        d['Type'] = PDFName('XObject')
+        d['Subtype'] = PDFName('Form')
+        d['FormType'] = 1
+        d['Filter'] = PDFName('FlateDecode')
+        d['BBox'] = PDFArray([float(x) for x in page.mediaBox])
+        if '/Resources' in page:
+            d['Resources'] = self.convert(page['/Resources'])
+        self.doc.Reference(form, xObjectName(name))
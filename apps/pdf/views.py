@@ -50,7 +50,8 @@ class BaseEditorView(TemplateView):
     def get_preview_data(self):
         raise NotImplementedError()
 
-    def generate(self, row, override_layout=None, override_background=None):
+    def generate(self, row, override_layout=None, override_background=None, overlay=False):
+        # With ``overlay`` the page holds the layout only, the editor draws it over the background it shows.
         raise NotImplementedError()
 
     def get_layout_settings_key(self):
@@ -157,7 +158,8 @@ class BaseEditorView(TemplateView):
                 override_layout=(json.loads(self.request.POST.get("data"))
                                  if self.request.POST.get("data")
                                  else None),
-                override_background=cf.file if cf else None
+                override_background=cf.file if cf else None,
+                overlay=request.POST.get("overlay") == "true",
             )
 
             resp = HttpResponse(data, content_type=mimet)
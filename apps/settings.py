@@ -1,4 +1,5 @@
 import os
+import tempfile
 import dj_database_url
 import sentry_sdk
 from sentry_sdk.integrations.django import DjangoIntegration
@@ -155,12 +156,15 @@ if SENTRY_DSN:
 Q_CLUSTER = {
     'name': 'DjangORM',
     'workers': 2,
-    'timeout': 90,
-    'retry': 120,
+    # Long enough for a large merge job; retry has to stay above timeout.
+    'timeout': 1800,
+    'retry': 1860,
     'max_attempts': 3,
     'queue_limit': 50,
     'bulk': 10,
     'catch_up': False,
+    # Merge jobs render large downloads on a process pool of their own, daemonic workers cannot start one.
+    'daemonize_workers': False,
     'orm': 'default'
 }
 
@@ -170,4 +174,20 @@ APP_LINK = "https://pdf.tixsumo.com"
 APP_EMAIL = os.environ.get("APP_EMAIL", "pdf@tixsumo.com")
 APP_DESCRIPTION = "Pdf mail merger, pdf editor, pdf generator for Excel & CSV files"
 
+# Downloads with at least PDF_PARALLEL_MIN_ROWS rows are rendered on a pool of PDF_RENDER_PROCESSES processes
+PDF_RENDER_PROCESSES = int(os.environ.get("PDF_RENDER_PROCESSES", os.cpu_count() or 1))
+PDF_PARALLEL_MIN_ROWS = int(os.environ.get("PDF_PARALLEL_MIN_ROWS", 2000))
+# Downloads with at least PDF_ASYNC_MIN_ROWS rows are rendered on the django_q cluster
+PDF_ASYNC_MIN_ROWS = int(os.environ.get("PDF_ASYNC_MIN_ROWS", 500))
+# Rendered downloads are kept PDF_RENDER_CACHE_HOURS after their last use, PDF_RENDER_CACHE_SIZE bytes at most
+PDF_RENDER_CACHE_HOURS = int(os.environ.get("PDF_RENDER_CACHE_HOURS", 24))
+PDF_RENDER_CACHE_SIZE = int(os.environ.get("PDF_RENDER_CACHE_SIZE", 1024 * 1024 * 1024))
+# Each process keeps the backgrounds of recent editor previews parsed, PDF_BACKGROUND_CACHE_SIZE bytes of them at most
+PDF_BACKGROUND_CACHE_SIZE = int(os.environ.get("PDF_BACKGROUND_CACHE_SIZE", 64 * 1024 * 1024))
+# Media read from S3 is kept on local disk in MEDIA_CACHE_DIR, MEDIA_CACHE_SIZE bytes of it at most
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR", os.path.join(tempfile.gettempdir(), 'pdf-mail-merger-media'))
+MEDIA_CACHE_SIZE = int(os.environ.get("MEDIA_CACHE_SIZE", 2 * 1024 * 1024 * 1024))
+# Downloads kept on a storage that can presign URLs, like S3, are served by redirecting to it
+PDF_DOWNLOAD_REDIRECT = os.environ.get("PDF_DOWNLOAD_REDIRECT", "true") == "true"
+
 GRAPPELLI_ADMIN_TITLE = APP_NAME
@@ -14,10 +14,12 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_STORAGE_BUCKET_NAME = os.getenv('AWS_STORAGE_BUCKET_NAME')
 AWS_S3_CUSTOM_DOMAIN = os.getenv('AWS_S3_CUSTOM_DOMAIN')
+# Another S3 compatible service, like the minio of docker-compose.yml
+AWS_S3_ENDPOINT_URL = os.getenv('AWS_S3_ENDPOINT_URL')
 AWS_S3_OBJECT_PARAMETERS = {'CacheControl': 'max-age=86400'}
 AWS_DEFAULT_ACL = 'public-read'
 
-DEFAULT_FILE_STORAGE = 'apps.common.storages.MediaRootS3BotoStorage'
+DEFAULT_FILE_STORAGE = 'apps.common.storages.CachedMediaRootS3BotoStorage'
 
 # FIXME: Load worker file from another domain, we use whitenoise for now
 # STATICFILES_STORAGE = 'apps.common.storages.StaticRootS3BotoStorage'
@@ -667,7 +667,86 @@ var editor = {
     _preview: function () {
         $("#preview-form input[name=data]").val(JSON.stringify(editor.dump()));
         $("#preview-form input[name=background]").val(editor.uploaded_file_id);
+        if (!editor.pdf_page) {
+            $("#preview-form").get(0).submit();
+            return false;
+        }
+
+        // Only fetch the layout drawn on a blank page and lay it over the background shown already.
+        var data = new FormData($("#preview-form").get(0));
+        data.append('overlay', 'true');
+        var xhr = new XMLHttpRequest();
+        xhr.open('POST', window.location.href);
+        xhr.responseType = 'arraybuffer';
+        xhr.onload = function () {
+            $("#editor-preview").prop('disabled', false);
+            if (xhr.status === 200) {
+                editor._show_overlay(new Uint8Array(xhr.response));
+            } else {
+                $("#preview-form").get(0).submit();
+            }
+        };
+        xhr.onerror = function () {
+            $("#editor-preview").prop('disabled', false);
+            $("#preview-form").get(0).submit();
+        };
+        $("#editor-preview").prop('disabled', true);
+        xhr.send(data);
+        return false;
+    },
+
+    _show_overlay: function (data) {
+        PDFJS.getDocument({data: data}).promise.then(function (pdf) {
+            pdf.getPage(1).then(function (page) {
+                var viewport = page.getViewport(editor.pdf_scale);
+                var overlay = document.createElement('canvas');
+                overlay.width = viewport.width;
+                overlay.height = viewport.height;
+                var overlayContext = overlay.getContext('2d');
+                page.render({
+                    canvasContext: overlayContext,
+                    viewport: viewport,
+                    background: 'rgba(0, 0, 0, 0)'
+                }).then(function () {
+                    // Versions of pdf.js without the background option paint the page white first, the layout
+                    // then cannot be laid over the background without changing its colors.
+                    if (!editor._has_transparency(overlayContext, overlay.width, overlay.height)) {
+                        $("#preview-form").get(0).submit();
+                        return;
+                    }
+                    var background = editor.$pdfcv.get(0);
+                    var canvas = document.getElementById('preview-canvas');
+                    canvas.width = background.width;
+                    canvas.height = background.height;
+                    var context = canvas.getContext('2d');
+                    context.drawImage(background, 0, 0);
+                    context.drawImage(overlay, 0, 0);
+                    $("#preview-container").show();
+                });
+            });
+        }, function (reason) {
+            editor._error(gettext('The preview could not be loaded:') + ' ' + reason);
+        });
+    },
+
+    _has_transparency: function (context, width, height) {
+        var pixels = context.getImageData(0, 0, width, height).data;
+        for (var i = 3; i < pixels.length; i += 4) {
+            if (pixels[i] === 0) {
+                return true;
+            }
+        }
+        return false;
+    },
+
+    _preview_close: function () {
+        $("#preview-container").hide();
+        return false;
+    },
+
+    _preview_pdf: function () {
         $("#preview-form").get(0).submit();
+        return false;
     },
 
     _replace_pdf_file: function (url) {
@@ -725,12 +804,15 @@ var editor = {
         editor.$cva.on("keydown", editor._on_keydown);
         $("#editor-save").on("click", editor._save);
         $("#editor-preview").on("click", editor._preview);
+        $("#preview-close").on("click", editor._preview_close);
+        $("#preview-pdf").on("click", editor._preview_pdf);
         window.onbeforeunload = function () {
             if (editor.dirty) {
                 return gettext("Do you really want to leave the editor without saving your changes?");
             }
         };
         $("#source-container").hide();
+        $("#preview-container").hide();
 
         $("#pdf-empty").on("click", editor._create_empty_background);
         $('#fileupload').fileupload({